@@ -0,0 +1,355 @@
+'''
+Copyright 2012 Upverter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+from collections import Counter
+import csv
+from itertools import islice
+import json
+import logging
+from multiprocessing.pool import ThreadPool
+import Queue
+import sys
+import threading
+import time
+import uuid
+
+from beanstream import billing, errors
+
+log = logging.getLogger('beanstream.bulk')
+
+
+CARD_COLUMNS = ('card_owner', 'card_number', 'card_exp_month', 'card_exp_year', 'card_cvd')
+ADDRESS_COLUMNS = ('name', 'email', 'phone', 'address1', 'address2', 'city',
+        'province', 'postal_code', 'country')
+
+
+def read_csv(f):
+    """ Yield the rows of a CSV file, with a header line, as dicts. """
+    if isinstance(f, basestring):
+        with open(f, 'rb') as f:
+            for row in read_csv(f):
+                yield row
+        return
+
+    for row in csv.DictReader(f):
+        yield row
+
+
+def read_json_lines(f):
+    """ Yield the objects of a JSON lines file, one per non-blank line, as
+    dicts of str. """
+    if isinstance(f, basestring):
+        with open(f, 'rb') as f:
+            for row in read_json_lines(f):
+                yield row
+        return
+
+    for line in f:
+        if line.strip():
+            yield dict((str(key), _str(value)) for key, value in json.loads(line).iteritems())
+
+
+class Journal(object):
+    """ An append-only JSON lines log of bulk operation progress.
+
+    Each entry records the state of one input row, identified by its key; the
+    last entry for a key wins. Entries are flushed as they are written, so the
+    journal survives the process being killed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def load(self):
+        """ Returns a dict of the last entry for each key. """
+        entries = {}
+        try:
+            f = open(self.path, 'rb')
+        except IOError:
+            return entries
+
+        with f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a line cut short by a crash.
+                    log.warning('ignoring a truncated entry in %s', self.path)
+                    continue
+                entries[entry['key']] = entry
+
+        return entries
+
+    def write(self, key, state, **fields):
+        entry = dict(fields, key=key, state=state)
+        line = json.dumps(entry, sort_keys=True) + '\n'
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'ab')
+            self._file.write(line)
+            self._file.flush()
+        return entry
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _imap_bounded(pool, func, jobs, window):
+    """ Like pool.imap_unordered(func, jobs), but with at most window jobs
+    queued or running at once; the next job is taken from jobs only as one
+    completes, so a long input is read as it is processed rather than all at
+    once. """
+    done = Queue.Queue()
+
+    def call(job):
+        try:
+            return True, func(job)
+        except Exception:
+            return False, sys.exc_info()
+
+    jobs = iter(jobs)
+    in_flight = 0
+    for job in islice(jobs, window):
+        pool.apply_async(call, (job,), callback=done.put)
+        in_flight += 1
+
+    while in_flight:
+        ok, result = done.get()
+        in_flight -= 1
+        if not ok:
+            raise result[0], result[1], result[2]
+        for job in islice(jobs, 1):
+            pool.apply_async(call, (job,), callback=done.put)
+            in_flight += 1
+        yield result
+
+
+class PaymentProfileImporter(object):
+    """ Creates payment profiles in bulk, e.g. when migrating customers from
+    another processor.
+
+    Each input row is a dict with the CARD_COLUMNS, optionally the
+    ADDRESS_COLUMNS of the billing address, and optionally a customer_code.
+    Rows are committed with bounded concurrency and journaled by row number:
+    'pending' with the customer code just before the profile is created, then
+    'created', or 'failed' with the field errors from the response.
+
+    Rows without a customer code are given a random one before they are sent,
+    so a rerun over the same input with the same journal skips the rows that
+    are done, and for a row left pending, e.g. by a crash or a network error,
+    checks whether its profile exists before creating it again. Profiles are
+    thus never created twice.
+
+    Ex.
+        importer = PaymentProfileImporter(beangw, 'import.journal')
+        counts = importer.run(bulk.read_csv('customers.csv'))
+    """
+
+    def __init__(self, beanstream, journal_path, max_concurrency=4):
+        self.beanstream = beanstream
+        self.journal = Journal(journal_path)
+        self.max_concurrency = max_concurrency
+
+    def run(self, rows):
+        """ Import the rows, skipping those already done according to the
+        journal. Returns a Counter of the row states: 'created', 'failed',
+        'pending' for rows whose outcome is unknown, and 'skipped'.
+        """
+        done = self.journal.load()
+        counts = Counter()
+
+        def todo():
+            for idx, row in enumerate(rows):
+                entry = done.get(idx)
+                if entry and entry['state'] in ('created', 'failed'):
+                    counts['skipped'] += 1
+                else:
+                    yield idx, row, entry
+
+        pool = ThreadPool(self.max_concurrency)
+        try:
+            for entry in _imap_bounded(pool, self._import, todo(), self.max_concurrency):
+                counts[entry['state']] += 1
+        finally:
+            pool.close()
+            pool.join()
+            self.journal.close()
+
+        log.info('imported payment profiles: %s', dict(counts))
+        return counts
+
+    def _import(self, job):
+        idx, row, entry = job
+        try:
+            card = billing.CreditCard(*[row.get(column) for column in CARD_COLUMNS])
+            address = None
+            if row.get('name') or row.get('email'):
+                address = billing.Address(*[row.get(column) or None for column in ADDRESS_COLUMNS])
+        except (errors.ValidationException, ValueError) as e:
+            return self.journal.write(idx, 'failed', errors={'message': str(e)})
+
+        if entry:
+            customer_code = entry['customer_code']
+            try:
+                resp = self.beanstream.get_payment_profile(customer_code).commit()
+            except Exception as e:
+                log.warning('could not check for the profile of row %d: %s', idx, e)
+                return entry
+            if resp is False:
+                # the lookup failed, so whether the profile exists is unknown.
+                log.warning('could not check for the profile of row %d', idx)
+                return entry
+            if resp.approved():
+                return self.journal.write(idx, 'created', customer_code=customer_code)
+        else:
+            customer_code = row.get('customer_code') or uuid.uuid4().hex
+            entry = self.journal.write(idx, 'pending', customer_code=customer_code)
+
+        txn = self.beanstream.create_payment_profile(card, address)
+        txn.set_customer_code(customer_code)
+        try:
+            resp = txn.commit()
+        except Exception as e:
+            log.warning('could not create the profile of row %d: %s', idx, e)
+            return entry
+
+        if not resp:
+            return entry
+        if not resp.approved():
+            return self.journal.write(idx, 'failed', customer_code=customer_code, errors=resp.get_errors())
+        return self.journal.write(idx, 'created', customer_code=resp.customer_code() or customer_code)
+
+
+class RateLimiter(object):
+    """ A token bucket allowing rate calls per second on average, in bursts
+    of up to burst calls. Shared by threads. """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = burst
+
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._last = time.time()
+
+    def acquire(self):
+        """ Block until a call is allowed. """
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class RecurringBillingUpdater(object):
+    """ Modifies recurring billing accounts in bulk, e.g. to reprice them.
+
+    The input is a stream of (account_id, changes) pairs, where changes is a
+    dict of ModifyRecurringBillingAccount setters to call, without their set_
+    prefix, and the values to call them with. Accounts are modified with
+    bounded concurrency and, if rate is given, at most rate requests per
+    second.
+
+    Each account is journaled as 'modified', 'failed' with the message from
+    Beanstream, or 'error' if no response was received. A rerun with the same
+    journal skips the accounts modified or failed before; modifications are
+    idempotent, so accounts in error are simply sent again.
+
+    Ex.
+        updater = RecurringBillingUpdater(beangw, 'reprice.journal', rate=20)
+        results = updater.run((account_id, {'amount': 12}) for account_id in account_ids)
+    """
+
+    def __init__(self, beanstream, journal_path, max_concurrency=4, rate=None):
+        self.beanstream = beanstream
+        self.journal = Journal(journal_path)
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = RateLimiter(rate, burst=max_concurrency) if rate else None
+
+    def run(self, changes):
+        """ Apply the changes, skipping accounts already done according to
+        the journal. Returns a dict of the ModifyRecurringBillingAccountResponse
+        for each account modified in this run, keyed by account ID; an account
+        whose request raised maps to the exception instead.
+        """
+        done = self.journal.load()
+
+        def todo():
+            for account_id, account_changes in changes:
+                entry = done.get(str(account_id))
+                if not entry or entry['state'] == 'error':
+                    yield str(account_id), account_changes
+
+        results = {}
+        pool = ThreadPool(self.max_concurrency)
+        try:
+            for account_id, result in _imap_bounded(pool, self._modify, todo(), self.max_concurrency):
+                results[account_id] = result
+        finally:
+            pool.close()
+            pool.join()
+            self.journal.close()
+
+        log.info('modified %d recurring billing accounts', len(results))
+        return results
+
+    def _modify(self, job):
+        account_id, changes = job
+        try:
+            txn = self.beanstream.modify_recurring_billing_account(account_id)
+            for name, value in changes.iteritems():
+                getattr(txn, 'set_%s' % name)(value)
+        except Exception as e:
+            # a bad change, e.g. an amount that isn't a number, fails only its
+            # own account.
+            self.journal.write(account_id, 'failed', message=str(e) or type(e).__name__)
+            return account_id, e
+
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+
+        try:
+            resp = txn.commit()
+        except Exception as e:
+            log.warning('could not modify recurring billing account %s: %s', account_id, e)
+            self.journal.write(account_id, 'error', message=str(e))
+            return account_id, e
+
+        if not resp:
+            self.journal.write(account_id, 'error', message='request failed')
+        elif resp.approved():
+            self.journal.write(account_id, 'modified')
+        else:
+            self.journal.write(account_id, 'failed', message=resp.message())
+        return account_id, resp
+
+
+def _str(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if value is None:
+        return None
+    return str(value)
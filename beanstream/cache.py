@@ -0,0 +1,133 @@
+'''
+Copyright 2012 Upverter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+from collections import OrderedDict
+import threading
+import time
+
+
+class TTLCache(object):
+    """ A thread-safe, size-bounded LRU cache whose entries expire ttl seconds
+    after they are stored.
+
+    get_or_load() collapses concurrent loads of the same key into a single
+    call: the first caller loads the value while the others wait for, and
+    share, its result.
+    """
+
+    def __init__(self, max_size=1000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._flights = {}
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._get(key, default)
+
+    def set(self, key, value):
+        with self._lock:
+            self._set(key, value)
+
+    def invalidate(self, key):
+        """ Drop the entry for key. A load of key already in flight will not
+        store its result. """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._flights.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._flights.clear()
+
+    def get_or_load(self, key, load, cacheable=None):
+        """ Returns the cached value for key, or calls load() to get it.
+
+        Only one load of a key runs at a time; concurrent callers wait for it
+        and receive the same value, or the same exception. The value is
+        stored only if cacheable(value) is true, when cacheable is given.
+        """
+        with self._lock:
+            value = self._get(key, _missing)
+            if value is not _missing:
+                return value
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            return flight.wait()
+
+        try:
+            flight.value = load()
+        except Exception as e:
+            flight.error = e
+            raise
+        else:
+            return flight.value
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                    if flight.error is None and (cacheable is None or cacheable(flight.value)):
+                        self._set(key, flight.value)
+            flight.done.set()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key, default):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+
+        value, expires = entry
+        if expires <= time.time():
+            del self._entries[key]
+            return default
+
+        # mark as most recently used.
+        del self._entries[key]
+        self._entries[key] = entry
+        return value
+
+    def _set(self, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = (value, time.time() + self.ttl)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+class _Flight(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+_missing = object()
@@ -0,0 +1,89 @@
+'''
+Copyright 2012 Upverter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+from collections import namedtuple
+
+from beanstream.response_codes import avs_response_codes, response_codes
+
+
+Message = namedtuple('Message', 'id type approved cardholder_message merchant_message')
+AvsResult = namedtuple('AvsResult', 'code matched processed address_matched postal_matched message')
+Outcome = namedtuple('Outcome', 'approved message avs cvd')
+
+# message IDs are small integers, so messages are kept in a tuple indexed by
+# message ID, with None for unused IDs.
+MESSAGES = tuple(
+    Message(message_id, code['type'], code['approved'], code['cardholder_message'], code['merchant_message'])
+    if code is not None else None
+    for message_id, code in ((i, response_codes.get(str(i)))
+        for i in xrange(max(int(key) for key in response_codes) + 1)))
+
+AVS_RESULTS = tuple(
+    AvsResult(code, avs['result'] == '1', avs['processed'] == '1', avs['address'] == '1',
+        avs['postal'] == '1', avs['message'])
+    for code, avs in sorted(avs_response_codes.iteritems()))
+
+CVD_STATUSES = (
+    None,
+    'CVD Match',
+    'CVD Mismatch',
+    'CVD Not Verified',
+    'CVD Should have been present',
+    'CVD Issuer unable to process request',
+    'CVD Not Provided',
+)
+
+# responses carry IDs as strings; these map them straight to the entries
+# above, which is cheaper than converting each ID to an integer.
+_MESSAGE_IDS = dict((str(message.id), message) for message in MESSAGES if message is not None)
+_AVS_CODES = dict((avs.code, avs) for avs in AVS_RESULTS)
+_CVD_IDS = dict((str(cvd_id), status) for cvd_id, status in enumerate(CVD_STATUSES) if status)
+
+# there are few distinct outcomes, so each is built once and shared.
+_OUTCOMES = {}
+_OUTCOMES_MAX_SIZE = 4096
+
+
+def message(message_id):
+    """ Returns the Message for a message ID, given as a string or an
+    integer, or None if it is unknown. """
+    if isinstance(message_id, (int, long)):
+        return MESSAGES[message_id] if 0 <= message_id < len(MESSAGES) else None
+    return _MESSAGE_IDS.get(message_id)
+
+
+def avs_result(avs_id):
+    """ Returns the AvsResult for an AVS response code, or None. """
+    return _AVS_CODES.get(avs_id)
+
+
+def cvd_status(cvd_id):
+    """ '1' --> 'CVD Match' """
+    if isinstance(cvd_id, (int, long)):
+        return CVD_STATUSES[cvd_id] if 0 <= cvd_id < len(CVD_STATUSES) else None
+    return _CVD_IDS.get(cvd_id)
+
+
+def decode(approved, message_id, avs_id=None, cvd_id=None):
+    """ Decode the status fields of a response into an Outcome. Unknown or
+    missing IDs decode to None. """
+    key = (approved, message_id, avs_id, cvd_id)
+    outcome = _OUTCOMES.get(key)
+    if outcome is None:
+        outcome = Outcome(approved, message(message_id), avs_result(avs_id), cvd_status(cvd_id))
+        if len(_OUTCOMES) < _OUTCOMES_MAX_SIZE:
+            _OUTCOMES[key] = outcome
+    return outcome
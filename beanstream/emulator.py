@@ -0,0 +1,657 @@
+'''
+Copyright 2012 Upverter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import BaseHTTPServer
+from collections import Counter
+from datetime import date, datetime
+import errno
+import hashlib
+import logging
+import random
+import socket
+import SocketServer
+import sys
+import threading
+import time
+import urllib
+import urlparse
+import uuid
+
+from beanstream import reports, transport
+from beanstream.response_codes import response_codes
+
+log = logging.getLogger('beanstream.emulator')
+
+
+# cards which the emulator approves, mapped to their CVD, as listed for use in
+# the Beanstream sandbox.
+APPROVED_CARDS = {
+    '4030000010001234': '123',
+    '4504481742333': '123',
+    '4123450131003312': '123',
+    '5100000010001004': '123',
+    '5194930004875020': '123',
+    '5123450000002889': '123',
+    '5123450000000000': '123',
+    '371100001000131': '1234',
+    '6011500080009080': '123',
+}
+
+DECLINED_CARDS = set([
+    '4003050500040005',
+    '5100000020002000',
+    '342400001000180',
+    '6011000900901111',
+])
+
+# cards which are declined for amounts over $100.
+LIMITED_CARDS = set(['4504481742333'])
+
+DATETIME_FORMAT = '%m/%d/%Y %I:%M:%S %p'
+
+TRANSACTION_TYPE_NAMES = {
+    'P': 'Purchase',
+    'PA': 'Pre-Authorization',
+    'PAC': 'Pre-Authorization Completion',
+    'R': 'Return',
+    'VP': 'Void Purchase',
+    'VR': 'Void Return',
+}
+
+# adjustment types map 'V' onto the kind of transaction being voided.
+VOID_TYPES = {
+    'P': 'VP',
+    'R': 'VR',
+}
+
+CARD_TYPES = (
+    ('34', 'AM'),
+    ('37', 'AM'),
+    ('4', 'VI'),
+    ('5', 'MC'),
+    ('6', 'DI'),
+)
+
+
+class Emulator(object):
+    """ A local stand-in for the Beanstream API.
+
+    The emulator serves process_transaction.asp, payment_profile.asp,
+    recurring_billing.asp, report_download.asp and report.aspx over HTTP on
+    the loopback interface, answering in the same formats as Beanstream. It
+    keeps transactions, payment profiles and recurring billing accounts in
+    memory so that later reports and lookups see earlier requests.
+
+    Ex.
+        emulator = Emulator(latency=(0.05, 0.2), decline_rate=0.1)
+        emulator.start()
+        beangw = gateway.Beanstream(transport=emulator.transport())
+        ...
+        emulator.stop()
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, error_rate=0,
+            decline_rate=0, hashcode=None, seed=None):
+        """ Initialize the emulator.
+
+        Keyword arguments:
+            host: the interface to listen on; default loopback.
+            port: the port to listen on; default any free port.
+            latency: seconds to wait before answering each request, either a
+                number or a (min, max) tuple to draw uniformly from.
+            error_rate: the fraction of requests answered with an HTTP 500.
+            decline_rate: the fraction of otherwise approved purchases which
+                are declined.
+            hashcode: if given, process_transaction.asp requests must carry a
+                valid hashValue computed with this hashcode.
+            seed: seed for the random number generator driving latency, error
+                and decline injection.
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.decline_rate = decline_rate
+        self.hashcode = hashcode
+
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+        self.transactions = []
+        self.transactions_by_id = {}
+        self.order_numbers = set()
+        self.profiles = {}
+        self.accounts = {}
+        self.next_transaction_id = 10000000
+        self.next_account_id = 1000000
+        self.batch_number = 1
+
+        # the number of requests received, by endpoint.
+        self.requests = Counter()
+
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%s' % (self.host, self.port)
+
+    def start(self):
+        """ Start serving requests on a background thread. """
+        self.server = _Server((self.host, self.port), _Handler)
+        self.server.emulator = self
+        self.port = self.server.server_address[1]
+
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        log.info('Beanstream emulator listening on %s', self.url)
+
+    def stop(self):
+        """ Stop serving requests, closing any open connections. """
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server.close_requests()
+            self.thread.join()
+            self.server = None
+            self.thread = None
+
+    def transport(self, keep_alive=True, timeout=None):
+        """ Returns a transport which sends requests for the Beanstream API to
+        this emulator instead.
+        """
+        if keep_alive:
+            base = transport.PooledTransport(timeout=timeout)
+        else:
+            base = transport.UrllibTransport(timeout=timeout)
+        return EmulatorTransport(self, base)
+
+    def settle(self):
+        """ Close the current batch; later transactions go into a new one. """
+        with self.lock:
+            self.batch_number += 1
+
+    def handle(self, path, params):
+        """ Returns the (status, body) answer for a request. """
+        endpoint = path.rsplit('/', 1)[-1]
+        with self.lock:
+            self.requests[endpoint] += 1
+
+        self._delay()
+
+        if self.error_rate and self.random.random() < self.error_rate:
+            return 500, 'Internal Server Error'
+
+        handlers = {
+            'process_transaction.asp': self._process_transaction,
+            'payment_profile.asp': self._payment_profile,
+            'recurring_billing.asp': self._recurring_billing,
+            'report_download.asp': self._report_download,
+            'report.aspx': self._report,
+        }
+        if endpoint not in handlers:
+            return 404, 'Not Found'
+
+        with self.lock:
+            return 200, handlers[endpoint](params)
+
+    def _delay(self):
+        latency = self.latency
+        if isinstance(latency, (tuple, list)):
+            latency = self.random.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+
+    def _process_transaction(self, params):
+        if self.hashcode is not None and not self._valid_hash(params):
+            return 'Empty hash value'
+
+        trn_type = params.get('trnType', 'P')
+        amount = params.get('trnAmount', '0.00')
+        order_number = params.get('trnOrderNumber', '')
+        now = datetime.now()
+
+        result = {
+            'trnOrderNumber': order_number,
+            'trnAmount': amount,
+            'trnDate': now.strftime(DATETIME_FORMAT),
+            'responseType': 'T',
+            'paymentMethod': 'CC',
+            'errorType': 'N',
+            'avsProcessed': '0',
+            'avsId': '0',
+            'avsResult': '0',
+            'avsAddrMatch': '0',
+            'avsPostalMatch': '0',
+            'avsMessage': 'Address Verification not performed for this transaction.',
+        }
+        for idx in range(1, 6):
+            ref = params.get('ref%s' % idx)
+            if ref:
+                result['ref%s' % idx] = ref
+
+        original = None
+        card = {}
+        if trn_type in ('P', 'PA'):
+            message_id, card = self._authorize(params, result)
+        else:
+            message_id, original = self._adjust(params)
+            if original is not None:
+                card = original['card']
+                if trn_type == 'V':
+                    trn_type = VOID_TYPES.get(original['transaction_type'], 'VP')
+
+        if order_number and order_number in self.order_numbers:
+            message_id = '788'
+        self.order_numbers.add(order_number)
+
+        approved = response_codes[message_id]['approved']
+        transaction_id = str(self.next_transaction_id)
+        self.next_transaction_id += 1
+
+        result['trnId'] = transaction_id
+        result['trnType'] = trn_type
+        result['messageId'] = message_id
+        result['messageText'] = response_codes[message_id]['cardholder_message']
+        result['trnApproved'] = '1' if approved else '0'
+        if approved:
+            result['authCode'] = 'TEST'
+        if card:
+            result['cardType'] = card['type']
+
+        if approved and params.get('trnRecurring') == '1':
+            account_id = str(self.next_account_id)
+            self.next_account_id += 1
+            self.accounts[account_id] = {
+                'amount': amount,
+                'state': 'A',
+                'period': params.get('rbBillingPeriod'),
+                'increment': params.get('rbBillingIncrement'),
+            }
+            result['rbAccountId'] = account_id
+
+        self._record(params, result, now, card, original)
+        return urllib.urlencode(result)
+
+    def _authorize(self, params, result):
+        """ Returns the message id for a purchase or pre-authorization, along
+        with the card it was charged to. """
+        if 'customerCode' in params:
+            profile = self.profiles.get(params['customerCode'])
+            if profile is None or profile['status'] != 'A':
+                return '7', {}
+            card = profile['card']
+            cvd = ''
+        else:
+            card = {
+                'owner': params.get('trnCardOwner', ''),
+                'number': params.get('trnCardNumber', ''),
+                'expiry': params.get('trnExpMonth', '') + params.get('trnExpYear', ''),
+                'type': _card_type(params.get('trnCardNumber', '')),
+            }
+            cvd = params.get('trnCardCvd', '')
+
+        number = card['number']
+        message_id = '1'
+
+        if cvd:
+            if APPROVED_CARDS.get(number, cvd) == cvd:
+                result['cvdId'] = '1'
+            else:
+                result['cvdId'] = '2'
+                message_id = '7'
+        elif 'customerCode' not in params:
+            result['cvdId'] = '6'
+
+        if number in DECLINED_CARDS:
+            message_id = '7'
+        elif number in LIMITED_CARDS and float(params.get('trnAmount', 0)) > 100:
+            message_id = '7'
+        elif self.decline_rate and self.random.random() < self.decline_rate:
+            message_id = '7'
+
+        return message_id, card
+
+    def _adjust(self, params):
+        """ Returns the message id for an adjustment, along with the
+        transaction it adjusts. """
+        original = self.transactions_by_id.get(params.get('adjId'))
+        if original is None or original['transaction_response'] != '1':
+            return '7', None
+        return '1', original
+
+    def _record(self, params, result, now, card, original):
+        row = dict.fromkeys(reports.TransactionReportResponse._fields())
+        row.update({
+            'merchant_id': params.get('merchant_id'),
+            'merchant_name': 'Beanstream Emulator',
+            'transaction_id': result['trnId'],
+            'transaction_datetime': result['trnDate'],
+            'transaction_card_owner': card.get('owner'),
+            'transaction_ip': params.get('customerIP'),
+            'transaction_type': result['trnType'],
+            'transaction_amount': result['trnAmount'],
+            'transaction_original_amount': result['trnAmount'],
+            'transaction_returns': '0.00',
+            'transaction_order_number': result['trnOrderNumber'],
+            'transaction_batch_number': str(self.batch_number),
+            'transaction_auth_code': result.get('authCode'),
+            'transaction_card_type': card.get('type'),
+            'transaction_adjustment_to': original['transaction_id'] if original else None,
+            'transaction_response': result['trnApproved'],
+            'message_id': result['messageId'],
+            'eci': '7',
+            'eft_rejected': '0',
+            'eft_returned': '0',
+            'avs_response': result['avsId'],
+            'cvd_response': result.get('cvdId'),
+            'transaction_currency': 'CAD',
+        })
+        for prefix, key_prefix in (('ord', 'billing'), ('ship', 'shipping')):
+            for suffix, field in _ADDRESS_FIELDS:
+                row['%s_%s' % (key_prefix, field)] = params.get(prefix + suffix)
+
+        row['datetime'] = now
+        row['card'] = card
+        self.transactions.append(row)
+        self.transactions_by_id[row['transaction_id']] = row
+
+    def _valid_hash(self, params):
+        data = params.get('__body__', '')
+        data, _, hash_value = data.partition('&hashValue=')
+        for algorithm in (hashlib.md5, hashlib.sha1):
+            if algorithm(data + self.hashcode).hexdigest() == hash_value:
+                return True
+        return False
+
+    def _payment_profile(self, params):
+        operation = params.get('operationType')
+        customer_code = params.get('customerCode')
+        result = {
+            'trnOrderNumber': params.get('trnOrderNumber', ''),
+        }
+
+        if operation == 'N':
+            missing = [field for field in ('trnCardOwner', 'trnCardNumber') if not params.get(field)]
+            if missing:
+                result.update({
+                    'responseCode': '19',
+                    'responseMessage': 'Invalid field',
+                    'errorFields': ','.join(missing),
+                    'errorMessage': ''.join('%s is required<br>' % field for field in missing),
+                })
+                return urllib.urlencode(result)
+
+            customer_code = customer_code or uuid.uuid4().hex
+            self.profiles[customer_code] = {
+                'status': 'A',
+                'card': {},
+                'address': {},
+            }
+
+        profile = self.profiles.get(customer_code)
+        if profile is None:
+            result.update({
+                'responseCode': '2',
+                'responseMessage': 'Invalid customer code',
+            })
+            return urllib.urlencode(result)
+
+        if operation in ('N', 'M'):
+            if params.get('trnCardNumber'):
+                profile['card'] = {
+                    'owner': params.get('trnCardOwner', ''),
+                    'number': params['trnCardNumber'],
+                    'expiry': params.get('trnExpMonth', '') + params.get('trnExpYear', ''),
+                    'type': _card_type(params['trnCardNumber']),
+                }
+            for suffix, _ in _ADDRESS_FIELDS:
+                if params.get('ord' + suffix):
+                    profile['address']['ord' + suffix] = params['ord' + suffix]
+            if params.get('status'):
+                profile['status'] = params['status']
+
+        elif operation == 'Q':
+            card = profile['card']
+            result.update(profile['address'])
+            result.update({
+                'trnCardOwner': card['owner'],
+                'trnCardNumber': 'X' * (len(card['number']) - 4) + card['number'][-4:],
+                'trnCardExpiry': card['expiry'],
+                'status': profile['status'],
+            })
+
+        result.update({
+            'responseCode': '1',
+            'responseMessage': 'Operation Successful',
+            'customerCode': customer_code,
+        })
+        return urllib.urlencode(result)
+
+    def _recurring_billing(self, params):
+        account_id = params.get('rbAccountId', '')
+        account = self.accounts.get(account_id)
+
+        if account is None:
+            code, message = '2', 'Invalid account id'
+        else:
+            if params.get('Amount'):
+                account['amount'] = params['Amount']
+            if params.get('rbBillingState'):
+                account['state'] = params['rbBillingState']
+            if params.get('rbBillingPeriod'):
+                account['period'] = params['rbBillingPeriod']
+            if params.get('rbBillingIncrement'):
+                account['increment'] = params['rbBillingIncrement']
+            code, message = '1', 'Request successful'
+
+        return ('<?xml version="1.0"?>\n<response>\n<accountId>%s</accountId>\n'
+                '<code>%s</code>\n<message>%s</message>\n</response>\n') % (account_id, code, message)
+
+    def _report_download(self, params):
+        rows = self.transactions
+
+        if params.get('rptRange') == '1':
+            start = int(params.get('rptIdStart') or 0)
+            end = int(params.get('rptIdEnd') or 0)
+            rows = [row for row in rows if start <= int(row['transaction_id']) <= end]
+
+        if 'rptStartYear' in params:
+            start = _date(params, 'rptStart')
+            end = _date(params, 'rptEnd')
+            rows = [row for row in rows if start <= row['datetime'].date() <= end]
+
+        status = params.get('rptStatus', '0')
+        if status == '1':
+            rows = [row for row in rows if row['transaction_response'] == '1']
+        elif status == '2':
+            rows = [row for row in rows if row['transaction_response'] != '1']
+
+        if params.get('rptBatchNumber'):
+            rows = [row for row in rows if row['transaction_batch_number'] == str(params['rptBatchNumber'])]
+
+        if params.get('rptCardType'):
+            rows = [row for row in rows if row['transaction_card_type'] == params['rptCardType']]
+
+        return _tab_report(reports.TransactionReportResponse._fields(), rows)
+
+    def _report(self, params):
+        rows = self.transactions
+
+        if params.get('rptTransId'):
+            rows = [row for row in rows if row['transaction_id'] == params['rptTransId']]
+
+        if params.get('rptCcNumber'):
+            rows = [row for row in rows if row['card'].get('number') == params['rptCcNumber']]
+
+        if 'rptStartYear' in params:
+            start = _datetime(params, 'rptStart')
+            end = _datetime(params, 'rptEnd')
+            rows = [row for row in rows if start <= row['datetime'] <= end]
+
+        status = params.get('rptTransStatus')
+        if status == '1':
+            rows = [row for row in rows if row['transaction_response'] == '1']
+        elif status == '2':
+            rows = [row for row in rows if row['transaction_response'] != '1']
+
+        lookup_rows = []
+        for row in rows:
+            lookup_rows.append({
+                'transaction_id': row['transaction_id'],
+                'date': row['transaction_datetime'],
+                'source_ip': row['transaction_ip'],
+                'amount': row['transaction_amount'],
+                'type_id': row['transaction_type'],
+                'type_name': TRANSACTION_TYPE_NAMES.get(row['transaction_type']),
+                'card_type': row['transaction_card_type'],
+                'card_expiry': row['card'].get('expiry'),
+                'order_id': row['transaction_order_number'],
+                'batch_number': row['transaction_batch_number'],
+                'status': 'Approved' if row['transaction_response'] == '1' else 'Declined',
+            })
+
+        return _tab_report(reports.CreditCardLookupReportResponse._fields(), lookup_rows)
+
+
+class EmulatorTransport(transport.Transport):
+    """ Sends requests meant for the Beanstream API to an Emulator. """
+
+    def __init__(self, emulator, base):
+        super(EmulatorTransport, self).__init__(base.timeout)
+        self.emulator = emulator
+        self.base = base
+
+    def open(self, url, data, timeout=None):
+        parts = urlparse.urlsplit(url)
+        return self.base.open(self.emulator.url + parts.path, data, timeout)
+
+    def close(self):
+        self.base.close()
+
+
+_ADDRESS_FIELDS = (
+    ('Name', 'name'),
+    ('EmailAddress', 'email'),
+    ('PhoneNumber', 'phone'),
+    ('Address1', 'address1'),
+    ('Address2', 'address2'),
+    ('City', 'city'),
+    ('Province', 'province'),
+    ('PostalCode', 'postal'),
+    ('Country', 'country'),
+)
+
+
+def _card_type(number):
+    for prefix, card_type in CARD_TYPES:
+        if number.startswith(prefix):
+            return card_type
+    return 'NN'
+
+
+def _date(params, prefix):
+    return date(int(params[prefix + 'Year']), int(params[prefix + 'Month']), int(params[prefix + 'Day']))
+
+
+def _datetime(params, prefix):
+    return datetime(int(params[prefix + 'Year']), int(params[prefix + 'Month']), int(params[prefix + 'Day']),
+            int(params.get(prefix + 'Hour', 0)), int(params.get(prefix + 'Min', 0)), int(params.get(prefix + 'Sec', 0)))
+
+
+def _tab_report(fields, rows):
+    lines = ['\t'.join(fields)]
+    for row in rows:
+        lines.append('\t'.join(row[field] or '' for field in fields))
+    return '\r\n'.join(lines) + '\r\n'
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler_class):
+        BaseHTTPServer.HTTPServer.__init__(self, server_address, handler_class)
+        self.stopping = False
+        # the threads handling requests, by request socket.
+        self.open_requests = {}
+        self.open_requests_lock = threading.Lock()
+
+    def process_request_thread(self, request, client_address):
+        with self.open_requests_lock:
+            self.open_requests[request] = threading.current_thread()
+        try:
+            SocketServer.ThreadingMixIn.process_request_thread(self, request, client_address)
+        finally:
+            with self.open_requests_lock:
+                self.open_requests.pop(request, None)
+
+    def close_requests(self, timeout=5):
+        """ Shut down the sockets of the requests being handled, including
+        kept-alive connections waiting for their next request, and wait for
+        their threads to finish. """
+        self.stopping = True
+        with self.open_requests_lock:
+            open_requests = self.open_requests.items()
+
+        for request, thread in open_requests:
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        for request, thread in open_requests:
+            thread.join(timeout)
+
+    def handle_error(self, request, client_address):
+        # requests cut off by stop(), or by clients hanging up, are expected
+        # to fail.
+        error = sys.exc_info()[1]
+        if self.stopping or (isinstance(error, socket.error) and error.errno in (errno.ECONNRESET, errno.EPIPE)):
+            return
+        BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # buffer the status line, headers and body into a single write; unbuffered
+    # writes leave kept-alive clients waiting on delayed ACKs.
+    wbufsize = -1
+
+    def do_GET(self):
+        parts = urlparse.urlsplit(self.path)
+        self._answer(parts.path, parts.query)
+
+    def do_POST(self):
+        parts = urlparse.urlsplit(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        self._answer(parts.path, self.rfile.read(length))
+
+    def _answer(self, path, body):
+        params = dict(urlparse.parse_qsl(body))
+        params['__body__'] = body
+
+        status, content = self.server.emulator.handle(path, params)
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        log.debug('%s - %s', self.address_string(), format % args)
@@ -0,0 +1,190 @@
+'''
+Copyright 2012 Upverter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import hashlib
+import string
+from urllib import unquote
+
+from beanstream import errors
+
+
+# the characters urllib.quote_plus leaves alone, and what it turns every
+# character into.
+SAFE = string.ascii_letters + string.digits + '_.-'
+_QUOTED = dict((chr(c), chr(c) if chr(c) in SAFE else '%%%02X' % c) for c in xrange(256))
+_QUOTED[' '] = '+'
+_quote_char = _QUOTED.__getitem__
+
+# parameter names are few and fixed, so their quoted form is kept.
+_quoted_keys = {}
+MAX_QUOTED_KEYS = 1000
+
+HASH_ALGORITHMS = {
+    'MD5': hashlib.md5,
+    'SHA1': hashlib.sha1,
+}
+
+
+def quote_plus(value):
+    """ urllib.quote_plus for str values, skipping the work for values which
+    need no quoting. """
+    if not value.translate(None, SAFE):
+        return value
+    return ''.join(map(_quote_char, value))
+
+
+class RequestTemplate(object):
+    """ Request parameters which are the same for every request of a kind,
+    URL-encoded once. """
+
+    def __init__(self, params):
+        self.params = params
+        self.keys = frozenset(params)
+        self.encoded = encode_request(params)
+
+
+def encode_request(params, hash_algorithm=None, hashcode=None, prefix=''):
+    """ Returns params URL-encoded exactly as urllib.urlencode would encode
+    them, after the already encoded prefix, and followed by a hashValue
+    parameter if a hash algorithm is given.
+
+    The hash is fed the encoded parameters and then the hashcode, rather than
+    their concatenation, and parameter names are only quoted once.
+    """
+    pieces = []
+    append = pieces.append
+    for key, value in params.iteritems():
+        quoted_key = _quoted_keys.get(key)
+        if quoted_key is None:
+            quoted_key = quote_plus(str(key)) + '='
+            if len(_quoted_keys) < MAX_QUOTED_KEYS:
+                _quoted_keys[key] = quoted_key
+
+        if type(value) is not str:
+            value = str(value)
+        if value.translate(None, SAFE):
+            value = ''.join(map(_quote_char, value))
+        append(quoted_key + value)
+
+    if prefix:
+        pieces.insert(0, prefix)
+    data = '&'.join(pieces)
+    if hash_algorithm is None:
+        return data
+
+    if hash_algorithm not in HASH_ALGORITHMS:
+        raise errors.ConfigurationException('Hash method must be MD5 or SHA1')
+    hashobj = HASH_ALGORITHMS[hash_algorithm]()
+    hashobj.update(data)
+    hashobj.update(hashcode)
+    return data + '&hashValue=' + hashobj.hexdigest()
+
+
+class QueryString(object):
+    """ A query string response body, which behaves as the dict of lists
+    urlparse.parse_qs returns for it.
+
+    The body is split into names and still encoded values in a single pass;
+    a value is only decoded when it is read.
+    """
+
+    __slots__ = ('_raw',)
+
+    def __init__(self, body):
+        raw = {}
+        # parse_qs splits on both separators and drops blank values.
+        for pair in body.replace(';', '&').split('&'):
+            name, sep, value = pair.partition('=')
+            if not value:
+                continue
+            name = _decode(name)
+            if name in raw:
+                previous = raw[name]
+                raw[name] = previous + [value] if type(previous) is list else [previous, value]
+            else:
+                raw[name] = value
+        self._raw = raw
+
+    def first(self, name, default=None):
+        """ Returns the first value of name, or default. """
+        value = self._raw.get(name)
+        if value is None:
+            return default
+        if type(value) is list:
+            value = value[0]
+        return _decode(value)
+
+    def __getitem__(self, name):
+        value = self._raw[name]
+        if type(value) is list:
+            return [_decode(v) for v in value]
+        return [_decode(value)]
+
+    def get(self, name, default=None):
+        if name not in self._raw:
+            return default
+        return self[name]
+
+    def __contains__(self, name):
+        return name in self._raw
+
+    has_key = __contains__
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __len__(self):
+        return len(self._raw)
+
+    def keys(self):
+        return self._raw.keys()
+
+    def iterkeys(self):
+        return self._raw.iterkeys()
+
+    def iteritems(self):
+        for name in self._raw:
+            yield name, self[name]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def values(self):
+        return [self[name] for name in self._raw]
+
+    def __eq__(self, other):
+        return dict(self.iteritems()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+    def __getstate__(self):
+        return self._raw
+
+    def __setstate__(self, raw):
+        self._raw = raw
+
+
+def _decode(value):
+    # urllib.unquote_plus, skipping the work for values which need none.
+    if '+' in value:
+        value = value.replace('+', ' ')
+    if '%' in value:
+        value = unquote(value)
+    return value
@@ -25,3 +25,18 @@ class ConfigurationException(Error):
 class ValidationException(Error):
     pass
 
+
+class ResponseException(Error):
+    pass
+
+
+class OutcomeUnknownException(Error):
+    pass
+
+
+class CircuitOpenException(Error):
+    pass
+
+
+class ConcurrencyLimitException(Error):
+    pass
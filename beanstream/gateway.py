@@ -14,7 +14,13 @@ See the License for the specific language governing permissions and
 limitations under the License.
 '''
 
-from beanstream import errors, payment_profiles, process_transaction, recurring_billing, reports
+import logging
+from multiprocessing.pool import ThreadPool
+import threading
+
+from beanstream import cache, encoding, errors, limits, order_numbers, payment_profiles, process_transaction, recurring_billing, reports, transaction, transport
+
+log = logging.getLogger('beanstream.gateway')
 
 class Beanstream(object):
 
@@ -30,6 +36,49 @@ class Beanstream(object):
                 simultaneously.
             require_cvd: True to enable; default disabled.
             require_billing_address: True to enable; default disabled.
+            keep_alive: True to reuse connections to the Beanstream API
+                between requests; default disabled.
+            pool_size: the maximum number of idle connections kept per host
+                when keep_alive is enabled; default 4.
+            pool_idle_timeout: seconds an idle connection is kept before it
+                is discarded when keep_alive is enabled; default 30.
+            timeout: timeout in seconds for requests to the Beanstream API;
+                default none.
+            transport: an instance of a transport.Transport subclass used to
+                send requests; overrides keep_alive and timeout. Defaults to
+                a new connection per request using urllib2.
+            async_workers: the number of worker threads used to run
+                transactions committed with commit_async; default 10.
+            batch_concurrency: the most transactions committed at once by
+                all commit_many calls on the gateway together; default
+                async_workers.
+            report_cache: a report_cache.ReportCache which report items are
+                written through to, and which answers lookups of settled
+                transactions; default none.
+            payment_profile_cache_size: the number of GetPaymentProfile
+                responses to cache; default 0, which disables the cache.
+            payment_profile_cache_ttl: seconds a GetPaymentProfile response
+                is cached for; default 60.
+            order_number_generator: an object whose generate() returns a new
+                30 character order number; default an
+                order_numbers.RandomOrderNumberGenerator.
+            retry_policy: a retry.RetryPolicy for requests which fail with a
+                network or server error; default none, no retries.
+            circuit_breaker_failures: the number of consecutive failed
+                requests to an endpoint after which requests to it fail fast
+                with errors.CircuitOpenException; default 0, disabled.
+            circuit_breaker_reset: seconds before a request is let through
+                to an endpoint whose circuit is open; default 30.
+            concurrency_limit: the most requests in flight to each endpoint;
+                requests over the limit raise
+                errors.ConcurrencyLimitException. The limit is lowered while
+                an endpoint fails or is slow, and raised again as it recovers.
+                Default 0, unlimited.
+            concurrency_limits: a dict of concurrency limits for endpoints,
+                keyed by their names in Transaction.URLS, overriding
+                concurrency_limit; e.g. {'report_download': 2}.
+            latency_target: seconds above which a request counts as slow for
+                the concurrency limit; default none.
         """
 
         self.HASH_VALIDATION = options.get('hash_validation', False)
@@ -41,10 +90,67 @@ class Beanstream(object):
             raise errors.ConfigurationException('Only one validation method may be specified')
 
         self.merchant_id = None
+        self.login_company = None
+        self.login_user = None
+        self.login_password = None
         self.username = None
         self.password = None
         self.hashcode = None
         self.payment_profile_passcode = None
+        self.recurring_billing_passcode = None
+        self._compile_request_templates()
+
+        self.transport = options.get('transport', None)
+        if self.transport is None:
+            if options.get('keep_alive', False):
+                self.transport = transport.PooledTransport(
+                    max_size=options.get('pool_size', 4),
+                    idle_timeout=options.get('pool_idle_timeout', 30),
+                    timeout=options.get('timeout', None))
+            else:
+                self.transport = transport.UrllibTransport(
+                    timeout=options.get('timeout', None))
+
+        self.retry_policy = options.get('retry_policy', None)
+        self.hedging_policy = options.get('hedging_policy', None)
+
+        # circuit breakers and concurrency limiters, keyed by endpoint URL.
+        self.endpoint_guards = {}
+        concurrency_limits = options.get('concurrency_limits', {})
+        for name, url in transaction.Transaction.URLS.iteritems():
+            breaker = limiter = None
+            if options.get('circuit_breaker_failures', 0):
+                breaker = limits.CircuitBreaker(
+                    failure_threshold=options['circuit_breaker_failures'],
+                    reset_timeout=options.get('circuit_breaker_reset', 30))
+            concurrency_limit = concurrency_limits.get(name, options.get('concurrency_limit', 0))
+            if concurrency_limit:
+                limiter = limits.AdaptiveLimiter(
+                    max_limit=concurrency_limit,
+                    latency_target=options.get('latency_target', None))
+            if breaker or limiter:
+                self.endpoint_guards[url] = limits.EndpointGuard(breaker, limiter)
+        self.report_cache = options.get('report_cache', None)
+
+        self.payment_profile_cache = None
+        if options.get('payment_profile_cache_size', 0):
+            self.payment_profile_cache = cache.TTLCache(
+                max_size=options['payment_profile_cache_size'],
+                ttl=options.get('payment_profile_cache_ttl', 60))
+
+        self.order_number_generator = options.get('order_number_generator', None)
+        if self.order_number_generator is None:
+            self.order_number_generator = order_numbers.RandomOrderNumberGenerator()
+
+        self.async_workers = options.get('async_workers', 10)
+        self._worker_pool = None
+        self._worker_pool_lock = threading.Lock()
+
+        self.batch_concurrency = options.get('batch_concurrency', self.async_workers)
+        if self.batch_concurrency < 1:
+            raise errors.ConfigurationException('batch_concurrency must be at least 1')
+        self._batch_slots = threading.Semaphore(self.batch_concurrency)
+        self._batch_local = threading.local()
 
     def configure(self, merchant_id, login_company, login_user, login_password, **params):
         """ Configure the gateway.
@@ -75,6 +181,119 @@ class Beanstream(object):
         if self.HASH_VALIDATION and self.hash_algorithm not in ('MD5', 'SHA1'):
             raise errors.ConfigurationException('hash algorithm must be one of MD5 or SHA1')
 
+        self._compile_request_templates()
+
+    def _compile_request_templates(self):
+        """ Encode the parameters which are the same for every request of a
+        kind once, rather than for every transaction.
+        """
+        common = {}
+        if self.USERNAME_VALIDATION:
+            common['username'] = self.username
+            common['password'] = self.password
+
+        templates = {
+            'transaction': {},
+            'process_transaction': {
+                'merchant_id': self.merchant_id,
+                'requestType': 'BACKEND',
+            },
+            'payment_profile': {
+                'serviceVersion': '1.0',
+                'merchantId': self.merchant_id,
+                'passCode': self.payment_profile_passcode,
+                'responseFormat': 'QS',
+            },
+            'recurring_billing': {
+                'merchantId': self.merchant_id,
+                'serviceVersion': '1.0',
+                'passcode': self.recurring_billing_passcode,
+                'responseFormat': 'QS',
+            },
+            'report': {
+                'merchantId': self.merchant_id,
+                'loginCompany': self.login_company,
+                'loginUser': self.login_user,
+                'loginPass': self.login_password,
+                'rptFormat': 'TAB',
+                'rspFormat': 'NVP',
+                'rptTarget': 'INLINE',
+            },
+        }
+
+        self.request_templates = dict((name, encoding.RequestTemplate(dict(common, **params)))
+                for name, params in templates.iteritems())
+
+    def close(self):
+        """ Close any connections held open to the Beanstream API and stop
+        the worker threads used by commit_async.
+        """
+        with self._worker_pool_lock:
+            worker_pool, self._worker_pool = self._worker_pool, None
+
+        if worker_pool:
+            worker_pool.close()
+            worker_pool.join()
+
+        self.transport.close()
+
+    def submit(self, func, *args, **kwargs):
+        """ Run func(*args, **kwargs) on the gateway's worker threads.
+        Returns a multiprocessing.pool.AsyncResult; call get() on it to wait
+        for and return the result, or to re-raise the exception raised.
+        """
+        with self._worker_pool_lock:
+            if self._worker_pool is None:
+                self._worker_pool = ThreadPool(self.async_workers)
+            worker_pool = self._worker_pool
+
+        return worker_pool.apply_async(func, args, kwargs)
+
+    def commit_many(self, transactions, max_concurrency=None):
+        """ Commit a batch of transactions, at most max_concurrency at a time
+        (default async_workers). Concurrent batches on the same gateway share
+        its batch_concurrency limit, so together they never commit more than
+        that many transactions at once.
+
+        Returns a list with one entry per transaction, in the order the
+        transactions were given: the result of its commit(), or the exception
+        raised while committing it. A failed transaction does not stop the
+        rest of the batch.
+        """
+        transactions = list(transactions)
+        if not transactions:
+            return []
+
+        max_concurrency = max_concurrency or self.async_workers
+        if max_concurrency < 1:
+            raise errors.ConfigurationException('max_concurrency must be at least 1')
+
+        # a transaction in a batch may commit a batch of its own, e.g. a
+        # TransactionSetReport; it gives up its slot meanwhile, so that nested
+        # batches cannot deadlock.
+        holding = getattr(self._batch_local, 'holding', False)
+        if holding:
+            self._batch_local.holding = False
+            self._batch_slots.release()
+
+        worker_pool = ThreadPool(min(max_concurrency, self.batch_concurrency, len(transactions)))
+        try:
+            return worker_pool.map(self._commit_batched, transactions, chunksize=1)
+        finally:
+            worker_pool.close()
+            worker_pool.join()
+            if holding:
+                self._batch_slots.acquire()
+                self._batch_local.holding = True
+
+    def _commit_batched(self, txn):
+        with self._batch_slots:
+            self._batch_local.holding = True
+            try:
+                return _commit(txn)
+            finally:
+                self._batch_local.holding = False
+
     def purchase(self, amount, card, billing_address=None):
         """ Returns a Purchase object with the specified options.
         """
@@ -202,11 +421,17 @@ class Beanstream(object):
         txn = reports.TransactionReport(self)
         return txn
 
-    def get_transaction_set_report(self, transaction_ids):
+    def get_transaction_set_report(self, transaction_ids, **options):
         """ Returns a TransactionSetReport object for the specified set of
         transaction IDs.
+
+        Keyword arguments:
+            max_gap: IDs further apart than this are fetched with separate
+                ranged requests; default 1000.
+            max_concurrency: the maximum number of ranged requests in flight;
+                default 4.
         """
-        txn = reports.TransactionSetReport(self, transaction_ids)
+        txn = reports.TransactionSetReport(self, transaction_ids, **options)
 
         return txn
 
@@ -221,3 +446,10 @@ class Beanstream(object):
 
         return txn
 
+
+def _commit(txn):
+    try:
+        return txn.commit()
+    except Exception as e:
+        log.exception('error committing %s', txn.__class__.__name__)
+        return e
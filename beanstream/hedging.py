@@ -0,0 +1,147 @@
+'''
+Copyright 2012 Upverter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+from collections import deque
+import logging
+import math
+import Queue
+import sys
+import threading
+import time
+
+from beanstream import transaction
+
+log = logging.getLogger('beanstream.hedging')
+
+
+class HedgingPolicy(object):
+    """ Hedges read only requests: if a request has not been answered within
+    the given percentile of the recent latency of its endpoint, a second,
+    identical request is sent and whichever answers first is used.
+
+    Only transactions marked read_only are ever hedged, and only those sent
+    to the given endpoints, named as in Transaction.URLS. Transaction reports
+    (report_download) are left out by default, since they can be large.
+
+    Ex.
+        beangw = gateway.Beanstream(hedging_policy=hedging.HedgingPolicy(percentile=95))
+    """
+
+    def __init__(self, percentile=95, window=200, min_samples=20, min_delay=0.01,
+            endpoints=('payment_profile', 'report')):
+        """ Create a hedging policy.
+
+        Arguments:
+            percentile: the percentile of recent latency after which a
+                second request is sent
+            window: the number of recent requests per endpoint the
+                percentile is taken over
+            min_samples: the number of requests to an endpoint seen before
+                its requests are hedged
+            min_delay: the shortest time, in seconds, to wait before hedging
+            endpoints: the names of the endpoints whose requests are hedged
+        """
+        self.percentile = percentile
+        self.window = window
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.urls = set(transaction.Transaction.URLS[name] for name in endpoints)
+
+        self._lock = threading.Lock()
+        self._latencies = {}
+
+    def applies(self, txn):
+        return txn.read_only and txn.url in self.urls
+
+    def delay(self, url):
+        """ Returns the seconds to wait for a request to url before hedging
+        it, or None if too few requests have been seen yet. """
+        with self._lock:
+            latencies = self._latencies.get(url)
+            if latencies is None or len(latencies) < self.min_samples:
+                return None
+            latencies = sorted(latencies)
+
+        idx = int(math.ceil(len(latencies) * self.percentile / 100.0)) - 1
+        return max(self.min_delay, latencies[max(0, idx)])
+
+    def record(self, url, latency):
+        with self._lock:
+            latencies = self._latencies.get(url)
+            if latencies is None:
+                latencies = self._latencies[url] = deque(maxlen=self.window)
+            latencies.append(latency)
+
+    def send(self, url, send, data):
+        """ Call send(data), hedging it with a second call if it is slow.
+        Returns the first result, or raises the error of the last attempt if
+        every attempt fails. """
+        delay = self.delay(url)
+        if delay is None:
+            return self._timed(url, send, data)
+
+        results = Queue.Queue()
+        lock = threading.Lock()
+        state = {'answered': False, 'hedged': False}
+
+        def hedge():
+            with lock:
+                if state['answered']:
+                    return
+                state['hedged'] = True
+            log.debug('hedging a request to %s after %.3f seconds', url, delay)
+            self._start(url, send, data, results)
+
+        self._start(url, send, data, results)
+        # the hedge is sent from a timer, since a timed Queue.get() polls and
+        # would add up to 50ms to every request.
+        timer = threading.Timer(delay, hedge)
+        timer.daemon = True
+        timer.start()
+
+        outcome = results.get()
+        with lock:
+            state['answered'] = True
+            hedged = state['hedged']
+        timer.cancel()
+
+        if outcome[0] or not hedged:
+            return self._result(outcome)
+        # the first answer was an error; the other attempt may still succeed.
+        return self._result(results.get())
+
+    def _timed(self, url, send, data):
+        start = time.time()
+        result = send(data)
+        self.record(url, time.time() - start)
+        return result
+
+    def _start(self, url, send, data, results):
+        def attempt():
+            try:
+                results.put((True, self._timed(url, send, data)))
+            except Exception:
+                results.put((False, sys.exc_info()))
+
+        thread = threading.Thread(target=attempt)
+        thread.daemon = True
+        thread.start()
+
+    def _result(self, outcome):
+        ok, result = outcome
+        if ok:
+            return result
+        raise result[0], result[1], result[2]
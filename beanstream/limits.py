@@ -0,0 +1,168 @@
+'''
+Copyright 2012 Upverter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import logging
+import threading
+import time
+
+from beanstream import errors
+
+log = logging.getLogger('beanstream.limits')
+
+
+class CircuitBreaker(object):
+    """ Fails requests fast once an endpoint has failed repeatedly.
+
+    After failure_threshold consecutive failures the breaker opens, and
+    requests raise errors.CircuitOpenException without being sent. Once
+    reset_timeout seconds have passed a single trial request is let through:
+    if it succeeds the breaker closes again, otherwise it stays open for
+    another reset_timeout.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self._trial or time.time() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def before(self):
+        """ Raise errors.CircuitOpenException if a request may not be sent. """
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if self._trial or time.time() - self.opened_at < self.reset_timeout:
+                raise errors.CircuitOpenException('circuit open after %d failures' % self.failures)
+            self._trial = True
+
+    def record(self, ok):
+        with self._lock:
+            if ok:
+                if self.opened_at is not None:
+                    log.info('circuit closed')
+                self.failures = 0
+                self.opened_at = None
+            else:
+                self.failures += 1
+                if self._trial or self.failures >= self.failure_threshold:
+                    if self.opened_at is None:
+                        log.warning('circuit opened after %d failures', self.failures)
+                    self.opened_at = time.time()
+            self._trial = False
+
+
+class AdaptiveLimiter(object):
+    """ Limits the number of requests in flight, adapting the limit with
+    AIMD: the limit grows by one per limit's worth of successful requests, and
+    is cut by backoff_ratio whenever a request fails or, if latency_target is
+    given, takes longer than it. Requests over the limit raise
+    errors.ConcurrencyLimitException rather than waiting.
+    """
+
+    def __init__(self, max_limit=20, min_limit=1, backoff_ratio=0.5, latency_target=None):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.backoff_ratio = backoff_ratio
+        self.latency_target = latency_target
+
+        self._lock = threading.Lock()
+        self.limit = float(max_limit)
+        self.in_flight = 0
+
+    def acquire(self):
+        with self._lock:
+            if self.in_flight >= int(self.limit):
+                raise errors.ConcurrencyLimitException('%d requests in flight' % self.in_flight)
+            self.in_flight += 1
+
+    def release(self, latency=None, ok=True):
+        """ Release a request; latency is None for a request not sent. """
+        with self._lock:
+            self.in_flight -= 1
+            if latency is None:
+                return
+            if not ok or (self.latency_target is not None and latency > self.latency_target):
+                self.limit = max(float(self.min_limit), self.limit * self.backoff_ratio)
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+
+
+class EndpointGuard(object):
+    """ The circuit breaker and concurrency limiter of one endpoint; either
+    may be None.
+
+    Ex.
+        with guard.request() as request:
+            status, body = transport.send(url, data)
+            if status >= 500:
+                request.failed()
+    """
+
+    def __init__(self, breaker=None, limiter=None):
+        self.breaker = breaker
+        self.limiter = limiter
+
+    def request(self):
+        return _Request(self)
+
+    def _enter(self):
+        if self.limiter:
+            self.limiter.acquire()
+        if self.breaker:
+            try:
+                self.breaker.before()
+            except errors.CircuitOpenException:
+                if self.limiter:
+                    self.limiter.release()
+                raise
+
+    def _exit(self, latency, ok):
+        if self.breaker:
+            self.breaker.record(ok)
+        if self.limiter:
+            self.limiter.release(latency, ok)
+
+
+class _Request(object):
+
+    def __init__(self, guard):
+        self.guard = guard
+        self.ok = True
+        self.start = None
+
+    def failed(self):
+        self.ok = False
+
+    def __enter__(self):
+        self.guard._enter()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.ok = False
+        self.guard._exit(time.time() - self.start, self.ok)
@@ -15,12 +15,13 @@ See the License for the specific language governing permissions and
 limitations under the License.
 '''
 
-from beanstream import transaction, utilities
-from beanstream.response_codes import response_codes
+from beanstream import decoding, transaction, utilities
 
 
 class RecurringBillingNotification(transaction.Response):
 
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super(RecurringBillingNotification, self).__init__(*args, **kwargs)
 
@@ -28,37 +29,36 @@ class RecurringBillingNotification(transaction.Response):
         self.resp = dict((k, [v]) if type(v) != list else (k, v) for k, v in self.resp.iteritems())
 
     def account_id(self):
-        return self.resp.get('billingId', [None])[0]
+        return self._value('billingId')
 
     def approved(self):
-        return self.resp.get('trnApproved', ['0'])[0] == '1'
+        return self._value('trnApproved', '0') == '1'
+
+    def outcome(self):
+        return decoding.decode(self.approved(), self._value('messageId'))
 
     def transaction_id(self):
-        return self.resp.get('trnId', [None])[0]
+        return self._value('trnId')
 
     def get_cardholder_message(self):
-        if 'messageId' in self.resp:
-            return response_codes[self.resp['messageId'][0]]['cardholder_message']
-        else:
-            return None
+        message = decoding.message(self._value('messageId'))
+        return message.cardholder_message if message else None
 
     def get_merchant_message(self):
-        if 'messageId' in self.resp:
-            return response_codes[self.resp['messageId'][0]]['merchant_message']
-        else:
-            return None
+        message = decoding.message(self._value('messageId'))
+        return message.merchant_message if message else None
 
     def auth_code(self):
-        return self.resp.get('authCode', [None])[0]
+        return self._value('authCode')
 
     def name(self):
-        return self.resp.get('accountName', [None])[0]
+        return self._value('accountName')
 
     def email(self):
-        return self.resp.get('emailAddress', [None])[0]
+        return self._value('emailAddress')
 
     def billing_amount(self):
-        return self.resp.get('billingAmount', [None])[0]
+        return self._value('billingAmount')
 
     def billing_date(self):
         if 'billingDate' in self.resp:
@@ -67,10 +67,10 @@ class RecurringBillingNotification(transaction.Response):
             return None
 
     def billing_period(self):
-        return self.resp.get('billingPeriod', [None])[0]
+        return self._value('billingPeriod')
 
     def billing_increment(self):
-        return self.resp.get('billingIncrement', [None])[0]
+        return self._value('billingIncrement')
 
     def period_from(self):
         if 'periodFrom' in self.resp:
@@ -0,0 +1,124 @@
+'''
+Copyright 2012 Upverter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import os
+import string
+import struct
+import threading
+import time
+
+from beanstream import errors
+
+
+ALPHABET = string.ascii_lowercase + string.digits
+LENGTH = 30
+
+# random bytes are mapped onto the alphabet by their value modulo 36; bytes of
+# 252 and up are dropped so that every character is equally likely.
+_LIMIT = 256 - 256 % len(ALPHABET)
+_TABLE = ''.join(ALPHABET[b % len(ALPHABET)] for b in xrange(256))
+_REJECTED = ''.join(chr(b) for b in xrange(_LIMIT, 256))
+
+# digits first, so that sequential order numbers sort as strings.
+_BASE36 = string.digits + string.ascii_lowercase
+
+
+class RandomOrderNumberGenerator(object):
+    """ Generates random 30 character order numbers from os.urandom.
+
+    Random bytes are read in bulk and buffered; the buffer is dropped after a
+    fork so that child processes never hand out the same order numbers.
+    """
+
+    def __init__(self, buffer_size=4096):
+        self.buffer_size = buffer_size
+
+        self._lock = threading.Lock()
+        self._chars = ''
+        self._offset = 0
+        self._pid = None
+
+    def generate(self):
+        with self._lock:
+            pid = os.getpid()
+            if pid != self._pid or self._offset + LENGTH > len(self._chars):
+                self._refill()
+                self._pid = pid
+
+            offset = self._offset
+            self._offset = offset + LENGTH
+            return self._chars[offset:offset + LENGTH]
+
+    def _refill(self):
+        chars = ''
+        while len(chars) < LENGTH:
+            chars += os.urandom(self.buffer_size).translate(_TABLE, _REJECTED)
+        self._chars = chars
+        self._offset = 0
+
+
+class SequentialOrderNumberGenerator(object):
+    """ Generates unique 30 character order numbers without randomness.
+
+    Each order number is made of the time in milliseconds, a node ID, the
+    process ID and a per-process sequence number, all in base 36. Order
+    numbers sort by the time they were generated at, and are unique across
+    processes and hosts as long as each host has its own node ID.
+    """
+
+    NODE_ID_LIMIT = len(ALPHABET) ** 8
+
+    def __init__(self, node_id=None):
+        """ Create a sequential order number generator.
+
+        Arguments:
+            node_id: an integer below 36 ** 8 identifying this host; defaults
+                to a random one, which is unique with high probability.
+        """
+        if node_id is None:
+            node_id = struct.unpack('>Q', os.urandom(8))[0] % self.NODE_ID_LIMIT
+        if not 0 <= node_id < self.NODE_ID_LIMIT:
+            raise errors.ConfigurationException('node id must be between 0 and %d' % (self.NODE_ID_LIMIT - 1))
+
+        self.node_id = node_id
+        self._node = _base36(node_id, 8)
+
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self._pid = None
+        self._process = None
+
+    def generate(self):
+        with self._lock:
+            pid = os.getpid()
+            if pid != self._pid:
+                self._pid = pid
+                self._process = _base36(pid % len(ALPHABET) ** 5, 5)
+                self._sequence = 0
+
+            sequence = self._sequence
+            self._sequence = (sequence + 1) % len(ALPHABET) ** 8
+
+            return '%s%s%s%s' % (_base36(int(time.time() * 1000), 9), self._node,
+                    self._process, _base36(sequence, 8))
+
+
+def _base36(value, width):
+    chars = []
+    while value:
+        value, digit = divmod(value, 36)
+        chars.append(_BASE36[digit])
+    return ''.join(reversed(chars)).rjust(width, '0')[-width:]
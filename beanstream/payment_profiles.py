@@ -16,8 +16,7 @@ limitations under the License.
 
 import logging
 
-from beanstream import billing, errors, transaction
-from beanstream.response_codes import response_codes
+from beanstream import billing, decoding, errors, transaction
 
 log = logging.getLogger('beanstream.payment_profiles')
 
@@ -45,10 +44,7 @@ class PaymentProfileTransaction(transaction.Transaction):
         if not self.beanstream.payment_profile_passcode:
             raise errors.ConfigurationException('payment profile passcode must be specified to create or modify payment profiles')
 
-        self.params['serviceVersion'] = '1.0'
-        self.params['merchantId'] = self.beanstream.merchant_id
-        self.params['passCode'] = self.beanstream.payment_profile_passcode
-        self.params['responseFormat'] = 'QS'
+        self.template = self.beanstream.request_templates['payment_profile']
 
     def set_customer_code(self, customer_code):
         self.params['customerCode'] = customer_code
@@ -88,24 +84,48 @@ class CreatePaymentProfile(PaymentProfileTransaction):
 
 class ModifyPaymentProfile(PaymentProfileTransaction):
 
+    idempotent = True
+
     def __init__(self, beanstream, customer_code):
         super(ModifyPaymentProfile, self).__init__(beanstream)
 
         self.params['operationType'] = 'M'
         self.set_customer_code(customer_code)
 
+    def commit(self):
+        try:
+            return super(ModifyPaymentProfile, self).commit()
+        finally:
+            # the profile may have changed even if the response was lost.
+            if self.beanstream.payment_profile_cache is not None:
+                self.beanstream.payment_profile_cache.invalidate(self.params['customerCode'])
+
 
 class GetPaymentProfile(PaymentProfileTransaction):
 
+    read_only = True
+
     def __init__(self, beanstream, customer_code):
         super(GetPaymentProfile, self).__init__(beanstream)
 
         self.params['operationType'] = 'Q'
         self.set_customer_code(customer_code)
 
+    def commit(self):
+        cache = self.beanstream.payment_profile_cache
+        if cache is None:
+            return super(GetPaymentProfile, self).commit()
+
+        return cache.get_or_load(
+            self.params['customerCode'],
+            super(GetPaymentProfile, self).commit,
+            cacheable=lambda resp: resp and resp.approved())
+
 
 class PaymentProfileResponse(transaction.Response):
 
+    __slots__ = ()
+
     field_name_mapping = {
         'ordName': 'name',
         'ordAddress1': 'address line 1',
@@ -122,20 +142,10 @@ class PaymentProfileResponse(transaction.Response):
     }
 
     def cvd_status(self):
-        cvd_statuses = {'1': 'CVD Match',
-                        '2': 'CVD Mismatch',
-                        '3': 'CVD Not Verified',
-                        '4': 'CVD Should have been present',
-                        '5': 'CVD Issuer unable to process request',
-                        '6': 'CVD Not Provided',
-                        }
-        if 'cvdId' in self.resp:
-            return cvd_statuses[self.resp['cvdId'][0]]
-        else:
-            return None
+        return decoding.cvd_status(self._value('cvdId'))
 
     def get_message(self):
-        return self.resp.get('responseMessage', [None])[0]
+        return self._value('responseMessage')
 
     def get_errors(self):
         if self.approved():
@@ -164,13 +174,16 @@ class PaymentProfileResponse(transaction.Response):
         return {}
 
     def customer_code(self):
-        return self.resp.get('customerCode', [None])[0]
+        return self._value('customerCode')
 
     def order_number(self):
-        return self.resp.get('trnOrderNumber', [None])[0]
+        return self._value('trnOrderNumber')
 
     def approved(self):
-        return self.resp.get('responseCode', ['0'])[0] == '1' and self.resp.get('trnApproved', ['1'])[0] == '1'
+        return self._value('responseCode', '0') == '1' and self._value('trnApproved', '1') == '1'
+
+    def outcome(self):
+        return decoding.decode(self.approved(), self._value('messageId'), self._value('avsId'), self._value('cvdId'))
 
     def status(self):
         if 'status' in self.resp:
@@ -180,25 +193,25 @@ class PaymentProfileResponse(transaction.Response):
 
     def billing_address(self):
         return billing.Address(
-            self.resp.get('ordName', [None])[0],
-            self.resp.get('ordEmailAddress', [None])[0],
-            self.resp.get('ordPhoneNumber', [None])[0],
-            self.resp.get('ordAddress1', [None])[0],
-            self.resp.get('ordAddress2', [None])[0],
-            self.resp.get('ordCity', [None])[0],
-            self.resp.get('ordProvince', [None])[0],
-            self.resp.get('ordPostalCode', [None])[0],
-            self.resp.get('ordCountry', [None])[0],
+            self._value('ordName'),
+            self._value('ordEmailAddress'),
+            self._value('ordPhoneNumber'),
+            self._value('ordAddress1'),
+            self._value('ordAddress2'),
+            self._value('ordCity'),
+            self._value('ordProvince'),
+            self._value('ordPostalCode'),
+            self._value('ordCountry'),
         )
 
     def bank_account_type(self):
-        return self.resp.get('bankAccountType', [None])[0]
+        return self._value('bankAccountType')
 
     def card_owner(self):
-        return self.resp.get('trnCardOwner', [None])[0]
+        return self._value('trnCardOwner')
 
     def card_number(self):
-        return self.resp.get('trnCardNumber', [None])[0]
+        return self._value('trnCardNumber')
 
     def expiry_month(self):
         if 'trnCardExpiry' in self.resp:
@@ -213,14 +226,10 @@ class PaymentProfileResponse(transaction.Response):
             return None
 
     def get_cardholder_message(self):
-        if 'messageId' in self.resp:
-            return response_codes[self.resp['messageId'][0]]['cardholder_message']
-        else:
-            return None
+        message = decoding.message(self._value('messageId'))
+        return message.cardholder_message if message else None
 
     def get_merchant_message(self):
-        if 'messageId' in self.resp:
-            return response_codes[self.resp['messageId'][0]]['merchant_message']
-        else:
-            return None
+        message = decoding.message(self._value('messageId'))
+        return message.merchant_message if message else None
 
@@ -14,11 +14,10 @@ See the License for the specific language governing permissions and
 limitations under the License.
 '''
 
-from datetime import datetime
+from datetime import date, datetime, timedelta
 import logging
 
-from beanstream import errors, transaction
-from beanstream.response_codes import response_codes
+from beanstream import decoding, errors, transaction, utilities
 
 log = logging.getLogger('beanstream.process_transaction')
 
@@ -29,15 +28,21 @@ class Purchase(transaction.Transaction):
         self.url = self.URLS['process_transaction']
         self.response_class = PurchaseResponse
 
-        self.params['merchant_id'] = self.beanstream.merchant_id
+        self.template = self.beanstream.request_templates['process_transaction']
+
         self.params['trnAmount'] = self._process_amount(amount)
-        self.params['requestType'] = 'BACKEND'
         self.params['trnType'] = self.TRN_TYPES['purchase']
 
         self.has_billing_address = False
         self.has_credit_card = False
         self.has_customer_code = False
 
+    def recover(self):
+        return recover_response(self)
+
+    def is_duplicate(self, resp):
+        return is_duplicate_order_number(resp)
+
     def validate(self):
         if (self.has_billing_address or self.has_credit_card) and self.has_customer_code:
             log.error('billing address or credit card specified with customer code')
@@ -75,52 +80,44 @@ class Purchase(transaction.Transaction):
 
 class PurchaseResponse(transaction.Response):
 
+    __slots__ = ()
+
     def cvd_status(self):
-        cvd_statuses = {'1': 'CVD Match',
-                        '2': 'CVD Mismatch',
-                        '3': 'CVD Not Verified',
-                        '4': 'CVD Should have been present',
-                        '5': 'CVD Issuer unable to process request',
-                        '6': 'CVD Not Provided',
-                        }
-        if 'cvdId' in self.resp:
-            return cvd_statuses[self.resp['cvdId'][0]]
-        else:
-            return None
+        return decoding.cvd_status(self._value('cvdId'))
 
     def transaction_id(self):
-        return self.resp.get('trnId', [None])[0]
+        return self._value('trnId')
 
     def get_cardholder_message(self):
-        if 'messageId' in self.resp:
-            return response_codes[self.resp['messageId'][0]]['cardholder_message']
-        else:
-            return None
+        message = decoding.message(self._value('messageId'))
+        return message.cardholder_message if message else None
 
     def get_merchant_message(self):
-        if 'messageId' in self.resp:
-            return response_codes[self.resp['messageId'][0]]['merchant_message']
-        else:
-            return None
+        message = decoding.message(self._value('messageId'))
+        return message.merchant_message if message else None
 
     def transaction_amount(self):
         ''' The amount the transaction was for. '''
-        return self.resp.get('trnAmount', [None])[0]
+        return self._value('trnAmount')
 
     def transaction_datetime(self):
         ''' The date and time that the transaction was processed, as a datetime object. '''
         if 'trnDate' in self.resp:
-            return datetime.strptime(self.resp['trnDate'][0], '%m/%d/%Y %I:%M:%S %p')
+            return utilities.process_datetime(self._value('trnDate'))
         else:
             return None
 
     def approved(self):
         ''' Boolean if the transaction was approved or not '''
-        return self.resp.get('trnApproved', ['0'])[0] == '1'
+        return self._value('trnApproved', '0') == '1'
+
+    def outcome(self):
+        ''' The approval, message, AVS result and CVD status, as a decoding.Outcome. '''
+        return decoding.decode(self.approved(), self._value('messageId'), self._value('avsId'), self._value('cvdId'))
 
     def auth_code(self):
         ''' if the transaction is approved this parameter will contain a unique bank-issued code '''
-        return self.resp.get('authCode', [None])[0]
+        return self._value('authCode')
 
 
 class PreAuthorization(Purchase):
@@ -140,7 +137,8 @@ class Adjustment(transaction.Transaction):
     VOID_PURCHASE = 'VP'
 
     def __init__(self, beanstream_gateway, adjustment_type, transaction_id, amount):
-        super(PreAuthorizationCompletion, self).__init__(beanstream_gateway)
+        super(Adjustment, self).__init__(beanstream_gateway)
+        self.response_class = PurchaseResponse
 
         if not beanstream_gateway.HASH_VALIDATION and not beanstream_gateway.USERNAME_VALIDATION:
             raise errors.ConfigurationException('adjustments must be performed with either hash or username/password validation')
@@ -148,7 +146,82 @@ class Adjustment(transaction.Transaction):
         if adjustment_type not in [self.RETURN, self.VOID, self.PREAUTH_COMPLETION, self.VOID_RETURN, self.VOID_PURCHASE]:
             raise errors.ConfigurationException('invalid adjustment_type specified: %s' % adjustment_type)
 
+        self.template = self.beanstream.request_templates['process_transaction']
+
         self.params['trnType'] = adjustment_type
         self.params['adjId'] = transaction_id
         self.params['trnAmount'] = self._process_amount(amount)
 
+    def recover(self):
+        return recover_response(self)
+
+    def is_duplicate(self, resp):
+        return is_duplicate_order_number(resp)
+
+
+# the message ID of a transaction rejected for reusing an order number.
+DUPLICATE_ORDER_NUMBER = '788'
+
+# how far either side of its first attempt a lost transaction is looked for.
+RECOVERY_WINDOW = timedelta(minutes=5)
+
+# the report fields a PurchaseResponse is rebuilt from.
+RECOVERED_FIELDS = {
+    'trnId': 'transaction_id',
+    'trnApproved': 'transaction_response',
+    'messageId': 'message_id',
+    'authCode': 'transaction_auth_code',
+    'trnAmount': 'transaction_amount',
+    'trnDate': 'transaction_datetime',
+    'trnOrderNumber': 'transaction_order_number',
+    'cardType': 'transaction_card_type',
+    'avsId': 'avs_response',
+    'cvdId': 'cvd_response',
+}
+
+
+def is_duplicate_order_number(resp):
+    return resp is not False and resp._value('messageId') == DUPLICATE_ORDER_NUMBER
+
+
+def recover_response(txn):
+    """ Look up a process transaction request by its order number. Returns a
+    response rebuilt from the transaction report, or None if the transaction
+    was not processed.
+
+    A transaction with a card number is found with a credit card lookup over
+    a few minutes around its first attempt, and only its own row of the
+    transaction report is fetched. Others, e.g. purchases with a payment
+    profile, are looked for in a transaction report covering the last day.
+    """
+    card_number = txn.params.get('trnCardNumber')
+    if card_number:
+        rows = _lookup_rows(txn, card_number)
+    else:
+        report = txn.beanstream.get_transaction_report()
+        report.set_date_range(date.today() - timedelta(days=1), date.today() + timedelta(days=1))
+        rows = report.stream()
+    if rows is False:
+        raise errors.ResponseException('transaction report request failed')
+
+    for row in rows:
+        # a resend rejected as a duplicate is in the report too.
+        if row.transaction_order_number == txn.order_number and row.message_id != DUPLICATE_ORDER_NUMBER:
+            resp = dict((key, [row[field]]) for key, field in RECOVERED_FIELDS.iteritems() if row[field])
+            return txn.response_class(resp, *txn.response_params)
+
+    return None
+
+
+def _lookup_rows(txn, card_number):
+    sent_at = txn.sent_at or datetime.now()
+    lookup = txn.beanstream.get_credit_card_lookup_report(card_number=card_number)
+    lookup.set_datetime_range(sent_at - RECOVERY_WINDOW, sent_at + RECOVERY_WINDOW)
+    resp = lookup.commit()
+    if resp is False:
+        return False
+
+    transaction_ids = [item['transaction_id'] for item in resp.items() if item['order_id'] == txn.order_number]
+    if not transaction_ids:
+        return []
+    return txn.beanstream.get_transaction_set_report(transaction_ids).commit()
@@ -65,6 +65,10 @@ class CreateRecurringBillingAccount(process_transaction.Purchase):
 
         self.params['rbBillingIncrement'] = frequency_increment
 
+    def recover(self):
+        # the account ID is not in transaction reports.
+        raise NotImplementedError
+
     def set_end_month(self, on):
         if self.params['rbBillingPeriod'] != 'M':
             log.warning('cannot set end_month attribute if billing period is not monthly')
@@ -97,13 +101,17 @@ class CreateRecurringBillingAccount(process_transaction.Purchase):
 
 class CreateRecurringBillingAccountResponse(process_transaction.PurchaseResponse):
 
+    __slots__ = ()
+
     def account_id(self):
         ''' The account id for the recurring billing account. '''
-        return self.resp.get('rbAccountId', [None])[0]
+        return self._value('rbAccountId')
 
 
 class ModifyRecurringBillingAccount(transaction.Transaction):
 
+    idempotent = True
+
     def __init__(self, beanstream, account_id):
         super(ModifyRecurringBillingAccount, self).__init__(beanstream)
         self.url = self.URLS['recurring_billing']
@@ -112,11 +120,9 @@ class ModifyRecurringBillingAccount(transaction.Transaction):
         if not self.beanstream.recurring_billing_passcode:
             raise errors.ConfigurationException('recurring billing passcode must be specified to modify recurring billing accounts')
 
-        self.params['merchantId'] = self.beanstream.merchant_id
-        self.params['serviceVersion'] = '1.0'
+        self.template = self.beanstream.request_templates['recurring_billing']
+
         self.params['operationType'] = 'M'
-        self.params['passcode'] = self.beanstream.recurring_billing_passcode
-        self.params['responseFormat'] = 'QS'
 
         self.params['rbAccountId'] = account_id
 
@@ -194,9 +200,11 @@ class ModifyRecurringBillingAccount(transaction.Transaction):
 
 class ModifyRecurringBillingAccountResponse(transaction.Response):
 
+    __slots__ = ()
+
     def approved(self):
-        return self.resp.get('code', [0])[0] == '1'
+        return self._value('code', 0) == '1'
 
     def message(self):
-        return self.resp.get('message', [None])[0]
+        return self._value('message')
 
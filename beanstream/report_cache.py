@@ -0,0 +1,195 @@
+'''
+Copyright 2012 Upverter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+from datetime import datetime, timedelta
+from itertools import islice
+import logging
+import sqlite3
+import threading
+
+from beanstream import reports, utilities
+
+log = logging.getLogger('beanstream.report_cache')
+
+
+class ReportCache(object):
+    """ A local SQLite store of the report items fetched from Beanstream.
+
+    When a gateway is configured with a report cache, every transaction report
+    and credit card lookup report writes its items through to the cache.
+    Transaction set reports and credit card lookups by transaction ID are then
+    served from the cache for settled transactions, and only the transactions
+    missing from it are fetched from Beanstream.
+
+    A transaction counts as settled if it was already older than
+    settled_after when it was fetched; more recent transactions may still
+    change, e.g. by being returned, and are always fetched again.
+    """
+
+    def __init__(self, path, settled_after=timedelta(days=1), batch_size=500):
+        """ Open, or create, a report cache.
+
+        Arguments:
+            path: the SQLite database file; ':memory:' for a private cache.
+            settled_after: the age after which a transaction no longer changes.
+            batch_size: the number of items written per transaction while
+                writing a report through to the cache.
+        """
+        self.path = path
+        self.settled_after = settled_after
+        self.batch_size = batch_size
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.text_factory = str
+
+        with self._lock:
+            with self._conn:
+                self._conn.executescript('''
+                    CREATE TABLE IF NOT EXISTS transactions (
+                        transaction_id INTEGER PRIMARY KEY,
+                        order_number TEXT,
+                        batch_number INTEGER,
+                        transaction_date TEXT,
+                        settled INTEGER NOT NULL,
+                        item BLOB NOT NULL);
+                    CREATE INDEX IF NOT EXISTS transactions_order_number ON transactions (order_number);
+                    CREATE INDEX IF NOT EXISTS transactions_batch_number ON transactions (batch_number);
+                    CREATE INDEX IF NOT EXISTS transactions_date ON transactions (transaction_date);
+
+                    CREATE TABLE IF NOT EXISTS lookups (
+                        transaction_id INTEGER PRIMARY KEY,
+                        settled INTEGER NOT NULL,
+                        item BLOB NOT NULL);
+                ''')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def write_through(self, items):
+        """ Yield the transaction report items, storing them as they pass. """
+        return self._write_through(items, self.store)
+
+    def write_through_lookups(self, items):
+        """ Yield the credit card lookup report items, storing them as they
+        pass. """
+        return self._write_through(items, self.store_lookups)
+
+    def store(self, items):
+        """ Store transaction report items. """
+        rows = []
+        for item in items:
+            when = self._datetime(item.transaction_datetime)
+            rows.append((
+                int(item.transaction_id),
+                item.transaction_order_number,
+                int(item.transaction_batch_number) if item.transaction_batch_number else None,
+                when.date().isoformat() if when else None,
+                self._settled(when),
+                buffer(_encode(item)),
+            ))
+
+        with self._lock:
+            with self._conn:
+                self._conn.executemany('INSERT OR REPLACE INTO transactions VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def store_lookups(self, items):
+        """ Store credit card lookup report items. """
+        fields = reports.CreditCardLookupReportResponse._fields()
+        rows = []
+        for item in items:
+            when = self._datetime(item['date'])
+            rows.append((
+                int(item['transaction_id']),
+                self._settled(when),
+                buffer(_encode([item[field] for field in fields])),
+            ))
+
+        with self._lock:
+            with self._conn:
+                self._conn.executemany('INSERT OR REPLACE INTO lookups VALUES (?, ?, ?)', rows)
+
+    def get(self, transaction_ids):
+        """ Returns a dict of the settled transaction report items cached for
+        the given transaction IDs, keyed by transaction ID. """
+        items = {}
+        transaction_ids = [int(txn_id) for txn_id in transaction_ids]
+        # stay under SQLite's limit on the number of query parameters.
+        for offset in xrange(0, len(transaction_ids), 500):
+            chunk = transaction_ids[offset:offset + 500]
+            query = 'SELECT item FROM transactions WHERE settled = 1 AND transaction_id IN (%s)' % ','.join('?' * len(chunk))
+            for item in self._query(query, chunk):
+                items[item.transaction_id] = item
+
+        return items
+
+    def get_lookup(self, transaction_id):
+        """ Returns the settled credit card lookup report item cached for the
+        transaction ID, or None. """
+        with self._lock:
+            row = self._conn.execute('SELECT item FROM lookups WHERE settled = 1 AND transaction_id = ?',
+                    (int(transaction_id),)).fetchone()
+
+        if row is None:
+            return None
+        return dict(zip(reports.CreditCardLookupReportResponse._fields(), _decode(row[0])))
+
+    def find_by_order_number(self, order_number):
+        """ Returns the cached transaction report items for an order number. """
+        return self._query('SELECT item FROM transactions WHERE order_number = ? ORDER BY transaction_id', (order_number,))
+
+    def find_by_batch_number(self, batch_number):
+        """ Returns the cached transaction report items in a batch. """
+        return self._query('SELECT item FROM transactions WHERE batch_number = ? ORDER BY transaction_id', (int(batch_number),))
+
+    def find_by_date(self, day):
+        """ Returns the cached transaction report items from a date. """
+        return self._query('SELECT item FROM transactions WHERE transaction_date = ? ORDER BY transaction_id', (day.isoformat(),))
+
+    def _query(self, query, params):
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+
+        return [reports.TransactionReportRow._make(_decode(row[0])) for row in rows]
+
+    def _write_through(self, items, store):
+        items = iter(items)
+        while True:
+            batch = list(islice(items, self.batch_size))
+            if not batch:
+                break
+
+            store(batch)
+            for item in batch:
+                yield item
+
+    def _datetime(self, value):
+        if not value:
+            return None
+        return utilities.process_datetime(value)
+
+    def _settled(self, when):
+        return int(when is not None and datetime.now() - when >= self.settled_after)
+
+
+# items are stored tab separated, as in the reports they came from.
+def _encode(values):
+    return '\t'.join(value or '' for value in values)
+
+
+def _decode(item):
+    return [value or None for value in str(item).split('\t')]
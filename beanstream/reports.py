@@ -14,10 +14,15 @@ See the License for the specific language governing permissions and
 limitations under the License.
 '''
 
+from array import array
+from collections import deque, namedtuple
+from datetime import timedelta
+from itertools import islice
 import logging
+from multiprocessing.pool import ThreadPool
 import re
 
-from beanstream import billing, errors, transaction
+from beanstream import billing, decoding, errors, transaction, utilities
 
 log = logging.getLogger('beanstream.reports')
 
@@ -31,55 +36,109 @@ TRANSACTION_TYPES = {
 }
 
 
+Categorical = namedtuple('Categorical', ['codes', 'categories'])
+
+
 class Report(transaction.Transaction):
 
+    read_only = True
+
     def __init__(self, beanstream):
         super(Report, self).__init__(beanstream)
         self.url = self.URLS['report_download']
         self.response_class = ReportResponse
 
-        self.params['merchantId'] = self.beanstream.merchant_id
-        self.params['loginCompany'] = self.beanstream.login_company
-        self.params['loginUser'] = self.beanstream.login_user
-        self.params['loginPass'] = self.beanstream.login_password
-
-        self.params['rptFormat'] = 'TAB'
-        self.params['rspFormat'] = 'NVP'
-        self.params['rptTarget'] = 'INLINE'
+        self.template = self.beanstream.request_templates['report']
 
     def parse_raw_response(self, body):
+        return list(self.parse_lines(body.split('\r\n')))
+
+    def parse_lines(self, lines):
+        """ Parse report items one at a time from an iterable of report lines,
+        the first of which is the header.
+        """
         fields = self.response_class._fields()
+        make_item = self.response_class._make_item
+        pattern = re.compile(r'\t'.join([r'([^\t]*)'] * len(fields)))
 
-        lines = body.split('\r\n')
+        lines = iter(lines)
+        next(lines, None)
 
-        report = []
-        pattern = re.compile(r'\t'.join([r'([^\t]*)'] * len(fields)))
-        for line in lines[1:]:
-            m = pattern.match(line)
+        for line in lines:
             if not line.strip():
                 continue
 
+            m = pattern.match(line)
             if m:
-                report_item = {}
-                for idx, field in enumerate(fields):
-                    if not m.groups()[idx] or m.groups()[idx] == '\x00':
-                        report_item[field] = None
-                    else:
-                        report_item[field] = m.groups()[idx]
-                report.append(report_item)
+                values = [None if not value or value == '\x00' else value for value in m.groups()]
+                yield make_item(fields, values)
 
             else:
                 raise errors.ValidationException('unexpected format received: %s' % line)
 
-        return report
+    def stream(self, chunk_size=65536):
+        """ Commit the report, reading and parsing the response body
+        incrementally. Returns a response which yields report items as they
+        are received, so memory use does not grow with the report size.
+        """
+        self.validate()
+
+        data = self.encode()
+        log.debug('Streaming from %s: %s', self.url, data)
+
+        guard = self.beanstream.endpoint_guards.get(self.url)
+        if guard is None:
+            res = self.beanstream.transport.open(self.url, data)
+        else:
+            # only the wait for the response headers counts against the
+            # limits; the body is read at the caller's pace.
+            with guard.request() as request:
+                res = self.beanstream.transport.open(self.url, data)
+                if res.code >= 500:
+                    request.failed()
+
+        if res.code != 200:
+            log.error('response code not OK: %s', res.code)
+            res.close()
+            return False
+
+        lines = _read_lines(res, chunk_size)
+        return self.response_class(self.parse_lines(lines), *self.response_params)
+
+
+def _read_lines(res, chunk_size):
+    """ Yield the CRLF-terminated lines of a response body, reading it
+    chunk_size bytes at a time. """
+    try:
+        pending = ''
+        while True:
+            chunk = res.read(chunk_size)
+            if not chunk:
+                break
+
+            lines = (pending + chunk).split('\r\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line
+
+        if pending:
+            yield pending
+    finally:
+        res.close()
 
 
 class ReportResponse(transaction.Response):
 
+    __slots__ = ()
+
     @classmethod
     def _fields(cls):
         return []
 
+    @classmethod
+    def _make_item(cls, fields, values):
+        return dict(zip(fields, values))
+
     def items(self):
         return self.resp
 
@@ -93,12 +152,71 @@ class TransactionReport(Report):
         self.params['rptVersion'] = '1.6'
         self.params['rptNoFile'] = '1'
 
+        self.transaction_range = None
+        self.date_range = None
+
+    def parse_lines(self, lines):
+        items = super(TransactionReport, self).parse_lines(lines)
+        if self.beanstream.report_cache:
+            items = self.beanstream.report_cache.write_through(items)
+        return items
+
+    def copy(self):
+        """ Returns a plain TransactionReport with the same options. """
+        txn = TransactionReport(self.beanstream)
+        txn.params.update(self.params)
+        txn.transaction_range = self.transaction_range
+        txn.date_range = self.date_range
+        return txn
+
+    def stream_sharded(self, shard_days=1, shard_size=10000, max_workers=4):
+        """ Fetch the report as a number of smaller reports ("shards") in
+        parallel. If a transaction range is set it is split into shards of
+        shard_size IDs, otherwise the date range is split into shards of
+        shard_days days.
+
+        Returns a response which yields the report items in order. At most
+        max_workers shards are fetched, or held waiting to be read, at once.
+        """
+        if shard_days < 1 or shard_size < 1:
+            raise errors.ValidationException('shard_days and shard_size must be at least 1')
+
+        if self.transaction_range:
+            start, end = [int(txn_id) for txn_id in self.transaction_range]
+            shards = [(str(shard_start), str(min(shard_start + shard_size - 1, end)))
+                    for shard_start in xrange(start, end + 1, shard_size)]
+            set_range = 'set_transaction_range'
+
+        elif self.date_range:
+            start, end = self.date_range
+            shards = []
+            while start <= end:
+                shard_end = min(start + timedelta(days=shard_days - 1), end)
+                shards.append((start, shard_end))
+                start = shard_end + timedelta(days=1)
+            set_range = 'set_date_range'
+
+        else:
+            raise errors.ValidationException('a transaction or date range must be set to shard a report')
+
+        txns = []
+        for shard_start, shard_end in shards:
+            txn = self.copy()
+            getattr(txn, set_range)(shard_start, shard_end)
+            txns.append(txn)
+
+        log.debug('fetching report in %d shards', len(txns))
+        return self.response_class(_fetch_in_order(txns, max_workers), *self.response_params)
+
     def set_transaction_range(self, start, end):
         self.params['rptRange'] = '1'
         self.params['rptIdStart'] = start
         self.params['rptIdEnd'] = end
+        self.transaction_range = (start, end)
 
     def set_date_range(self, start, end):
+        self.date_range = (start, end)
+
         self.params['rptStartYear'] = start.strftime('%Y')
         self.params['rptStartMonth'] = start.strftime('%m')
         self.params['rptStartDay'] = start.strftime('%d')
@@ -151,8 +269,32 @@ class TransactionReport(Report):
             del self.params['rptRef']
 
 
+def _fetch_in_order(txns, max_workers):
+    """ Commit the reports on up to max_workers threads, yielding the items
+    of each report in turn. """
+    worker_pool = ThreadPool(max_workers)
+    try:
+        txns = iter(txns)
+        pending = deque(worker_pool.apply_async(txn.commit) for txn in islice(txns, max_workers))
+
+        while pending:
+            resp = pending.popleft().get()
+            for txn in islice(txns, 1):
+                pending.append(worker_pool.apply_async(txn.commit))
+
+            if resp is False:
+                raise errors.ResponseException('report request failed')
+            for item in resp:
+                yield item
+    finally:
+        worker_pool.terminate()
+        worker_pool.join()
+
+
 class TransactionReportResponse(object):
 
+    CATEGORICAL_FIELDS = ('transaction_type', 'transaction_card_type', 'transaction_currency')
+
     @classmethod
     def _fields(cls):
         return ['merchant_id', 'merchant_name', 'transaction_id',
@@ -172,74 +314,304 @@ class TransactionReportResponse(object):
                 'cvd_response', 'transaction_currency']
 
     def __init__(self, report):
-        self.report = report
-
-        # do some additional post-processing.
-        for item in report:
-            # parse out the billing & shipping addresses.
-            self._process_address(item, 'billing')
-            self._process_address(item, 'shipping')
+        """ Wrap the items of a transaction report.
 
-            self._process_transaction_type(item)
+        Arguments:
+            report: a list of report items, or an iterator over them as
+                returned by Report.stream. Items from an iterator are
+                post-processed lazily as the response is iterated over.
+        """
+        self.report = self._process(report)
+        if isinstance(report, list):
+            self.report = list(self.report)
 
-    def _process_address(self, item, key_prefix):
-        fields = ['_name', '_email', '_phone', '_address1', '_address2',
-                '_city', '_province', '_postal', '_country']
-        if item['%s_name' % key_prefix] and item['%s_email' % key_prefix]:
-            address = billing.Address(
-                *[item[key_prefix + field] for field in fields])
-
-            item['%s_address' % key_prefix] = address
-
-        for field in fields:
-            del item[key_prefix + field]
+    @classmethod
+    def _make_item(cls, fields, values):
+        return TransactionReportRow._from_values(values)
+
+    def _process(self, report):
+        return iter(report)
+
+    def to_columns(self):
+        """ Returns the report as a dict of columns for vectorised analysis:
+
+            transaction_id, transaction_batch_number: arrays of ints.
+            transaction_amount, transaction_returns: arrays of amounts in
+                integer cents.
+            transaction_datetime: an array of POSIX timestamps in seconds.
+            transaction_type, transaction_card_type, transaction_currency:
+                Categorical(codes, categories); codes is an array of indexes
+                into the categories list, or -1 where the field is empty.
+
+        A streamed report is consumed by this call.
+        """
+        columns = {
+            'transaction_id': array('l'),
+            'transaction_batch_number': array('l'),
+            'transaction_amount': array('l'),
+            'transaction_returns': array('l'),
+            'transaction_datetime': array('l'),
+        }
+        categoricals = {}
+        for field in self.CATEGORICAL_FIELDS:
+            categoricals[field] = {}
+            columns[field] = Categorical(array('h'), [])
+
+        for item in self:
+            columns['transaction_id'].append(int(item.transaction_id or 0))
+            columns['transaction_batch_number'].append(int(item.transaction_batch_number or 0))
+            columns['transaction_amount'].append(utilities.process_cents(item.transaction_amount or '0'))
+            columns['transaction_returns'].append(utilities.process_cents(item.transaction_returns or '0'))
+
+            timestamp = 0
+            if item.transaction_datetime:
+                timestamp = utilities.process_timestamp(item.transaction_datetime)
+            columns['transaction_datetime'].append(timestamp)
+
+            for field in self.CATEGORICAL_FIELDS:
+                value = getattr(item, field)
+                codes, categories = columns[field]
+                if value is None:
+                    codes.append(-1)
+                    continue
+
+                code = categoricals[field].get(value)
+                if code is None:
+                    code = categoricals[field][value] = len(categories)
+                    categories.append(value)
+                codes.append(code)
+
+        return columns
+
+    def to_numpy(self):
+        """ Returns to_columns() as numpy arrays: int64 ids, batch numbers
+        and cents, datetime64[s] transaction times, and Categorical columns
+        with int16 codes. Requires numpy.
+        """
+        import numpy
+
+        columns = self.to_columns()
+        arrays = {}
+        for field, column in columns.iteritems():
+            if isinstance(column, Categorical):
+                arrays[field] = Categorical(
+                    numpy.array(column.codes, dtype=numpy.int16),
+                    numpy.array(column.categories, dtype=object))
+            else:
+                arrays[field] = numpy.array(column, dtype=numpy.int64)
 
-    def _process_transaction_type(self, item):
-        item['transaction_type'] = TRANSACTION_TYPES[item['transaction_type']]
+        arrays['transaction_datetime'] = arrays['transaction_datetime'].view('datetime64[s]')
+        return arrays
 
     def __iter__(self):
         return self.report.__iter__()
 
     def __len__(self):
+        # a lazily parsed report has to be read in full to be counted.
+        if not isinstance(self.report, list):
+            self.report = list(self.report)
         return len(self.report)
 
 
-class TransactionSetReport(TransactionReport):
-    """ Specify a set of transaction IDs for which to fetch details. This is
-    performed by fetching the range of transaction IDs and then filtering out
-    anything that wasn't passed in. """
+_ADDRESS_FIELDS = ('name', 'email', 'phone', 'address1', 'address2', 'city',
+        'province', 'postal', 'country')
+
+# fields which take few distinct values; interning them lets every row of a
+# report share one copy of each value.
+_INTERNED_FIELDS = ('merchant_id', 'merchant_name', 'transaction_batch_number',
+        'transaction_card_type', 'transaction_response', 'message_id', 'eci',
+        'eft_rejected', 'eft_returned', 'avs_response', 'cvd_response',
+        'transaction_currency')
+
 
-    def __init__(self, beanstream, transaction_ids):
+class TransactionReportRow(namedtuple('TransactionReportRow', TransactionReportResponse._fields())):
+    """ A single transaction from a transaction report.
+
+    Rows are namedtuples, so fields are read as attributes, e.g.
+    row.transaction_id; row['transaction_id'] and row.get('transaction_id')
+    work as well. The billing and shipping addresses are built into
+    billing.Address objects only when they are read.
+
+    Like the dicts report items used to be, `key in row` is true for the keys
+    which have a value, and keys() lists them, so dict(row) still works. Being
+    tuples, rows iterate over their values rather than their keys.
+    """
+
+    __slots__ = ()
+
+    _interned = tuple(TransactionReportResponse._fields().index(field) for field in _INTERNED_FIELDS)
+    _transaction_type = TransactionReportResponse._fields().index('transaction_type')
+    _key_order = tuple(TransactionReportResponse._fields() + ['billing_address', 'shipping_address'])
+    _keys = frozenset(_key_order)
+
+    @classmethod
+    def _from_values(cls, values):
+        for idx in cls._interned:
+            if values[idx] is not None:
+                values[idx] = intern(values[idx])
+
+        values[cls._transaction_type] = TRANSACTION_TYPES[values[cls._transaction_type]]
+        return tuple.__new__(cls, values)
+
+    def __getitem__(self, key):
+        if isinstance(key, basestring):
+            if key not in self._keys:
+                raise KeyError(key)
+            return getattr(self, key)
+        return tuple.__getitem__(self, key)
+
+    def __contains__(self, key):
+        if isinstance(key, basestring):
+            return key in self._keys and getattr(self, key) is not None
+        return tuple.__contains__(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        """ The names of the fields and addresses which have a value. """
+        return [key for key in self._key_order if key in self]
+
+    def outcome(self):
+        """ The approval, message, AVS result and CVD status, as a
+        decoding.Outcome. """
+        return decoding.decode(self.transaction_response == '1', self.message_id,
+                self.avs_response, self.cvd_response)
+
+    @property
+    def billing_address(self):
+        return self._address('billing')
+
+    @property
+    def shipping_address(self):
+        return self._address('shipping')
+
+    def _address(self, key_prefix):
+        values = [getattr(self, '%s_%s' % (key_prefix, field)) for field in _ADDRESS_FIELDS]
+        if values[0] and values[1]:
+            return billing.Address(*values)
+        return None
+
+    def to_dict(self):
+        """ Returns the row as a dict, with the addresses built. """
+        item = self._asdict()
+        item['billing_address'] = self.billing_address
+        item['shipping_address'] = self.shipping_address
+        return item
+
+
+_tuple_getitem = tuple.__getitem__
+
+def _field_property(idx):
+    # namedtuple's own field properties index the row through
+    # TransactionReportRow.__getitem__; these read the tuple directly.
+    return property(lambda self: _tuple_getitem(self, idx))
+
+for _idx, _field in enumerate(TransactionReportRow._fields):
+    setattr(TransactionReportRow, _field, _field_property(_idx))
+del _idx, _field
+
+
+class TransactionSetReport(TransactionReport):
+    """ Specify a set of transaction IDs for which to fetch details. The IDs
+    are grouped into clusters of nearby IDs; the range of each cluster is
+    fetched, concurrently if there is more than one, and anything that wasn't
+    passed in is filtered out. """
+
+    def __init__(self, beanstream, transaction_ids, max_gap=1000, max_concurrency=4):
+        """ Create a new transaction set report.
+
+        Arguments:
+            beanstream: gateway object
+            transaction_ids: the transaction IDs to fetch
+            max_gap: IDs further apart than this are fetched with separate
+                ranged requests rather than one request spanning both.
+            max_concurrency: the maximum number of ranged requests in flight.
+        """
         super(TransactionSetReport, self).__init__(beanstream)
         self.response_class = TransactionSetReportResponse
+        self.max_concurrency = max_concurrency
 
         # in case it was passed in as a generator, or as numbers, or both
-        transaction_ids = [str(txn_id) for txn_id in transaction_ids]
-        transaction_ids.sort()
-        self.response_params.append(transaction_ids)
+        transaction_ids = sorted(set(int(txn_id) for txn_id in transaction_ids))
+        self.response_params.append([str(txn_id) for txn_id in transaction_ids])
+
+        self.transaction_ids = transaction_ids
+        self.max_gap = max_gap
+        self.ranges = plan_ranges(transaction_ids, max_gap)
+        self.set_transaction_range(str(transaction_ids[0]), str(transaction_ids[-1]))
+
+    def commit(self):
+        ranges = self.ranges
+        report = []
+
+        cache = self.beanstream.report_cache
+        if cache:
+            cached = cache.get(self.transaction_ids)
+            if cached:
+                log.debug('%d of %d transactions served from the report cache', len(cached), len(self.transaction_ids))
+                report.extend(cached.itervalues())
+                missing = [txn_id for txn_id in self.transaction_ids if str(txn_id) not in cached]
+                ranges = plan_ranges(missing, self.max_gap)
+
+        if len(ranges) == 1 and not report:
+            return super(TransactionSetReport, self).commit()
 
-        self.set_transaction_range(transaction_ids[0], transaction_ids[-1])
+        txns = []
+        for start, end in ranges:
+            txn = self.copy()
+            txn.set_transaction_range(str(start), str(end))
+            txns.append(txn)
+
+        for resp in self.beanstream.commit_many(txns, self.max_concurrency):
+            if isinstance(resp, Exception):
+                raise resp
+            if resp is False:
+                return False
+            report.extend(resp)
+
+        report.sort(key=lambda item: int(item.transaction_id))
+        return self.response_class(report, *self.response_params)
+
+
+def plan_ranges(transaction_ids, max_gap):
+    """ Group sorted transaction IDs into (start, end) ranges, starting a new
+    range wherever consecutive IDs are more than max_gap apart. """
+    ranges = []
+    for txn_id in transaction_ids:
+        if ranges and txn_id - ranges[-1][1] <= max_gap:
+            ranges[-1][1] = txn_id
+        else:
+            ranges.append([txn_id, txn_id])
+
+    return [tuple(r) for r in ranges]
 
 
 class TransactionSetReportResponse(TransactionReportResponse):
 
     def __init__(self, response, transaction_ids):
+        self.transaction_ids = set(transaction_ids)
         super(TransactionSetReportResponse, self).__init__(response)
 
+    def _process(self, report):
         # filter out anything that wasn't in the original set.
-        report = []
-        for item in self.report:
-            if item['transaction_id'] in transaction_ids:
-                report.append(item)
-
-        self.report = report
+        for item in super(TransactionSetReportResponse, self)._process(report):
+            if item.transaction_id in self.transaction_ids:
+                yield item
 
 
 class CreditCardLookupReport(Report):
 
+    # parameters which are the same for every lookup.
+    LOOKUP_OPTIONS = ('rptFormat', 'rspFormat', 'rptTarget', 'rptAPIVersion', 'rptType')
+
     def __init__(self, beanstream):
         super(CreditCardLookupReport, self).__init__(beanstream)
         self.url = self.URLS['report']
+        self.response_class = CreditCardLookupReportResponse
 
         self.params['rptAPIVersion'] = '1.0'
         self.params['rptType'] = 'SEARCH'
@@ -248,6 +620,23 @@ class CreditCardLookupReport(Report):
         if 'rptTransId' not in self.params and 'rptCcNumber' not in self.params:
             raise errors.ValidationException('CreditCardLookupReport must specify one of transaction id or credit card number')
 
+    def commit(self):
+        # a lookup of just a transaction ID can be answered by the cache.
+        cache = self.beanstream.report_cache
+        filters = [key for key in self.params if key.startswith('rpt') and key not in self.LOOKUP_OPTIONS]
+        if cache and filters == ['rptTransId']:
+            item = cache.get_lookup(self.params['rptTransId'])
+            if item is not None:
+                return self.response_class([item], *self.response_params)
+
+        return super(CreditCardLookupReport, self).commit()
+
+    def parse_lines(self, lines):
+        items = super(CreditCardLookupReport, self).parse_lines(lines)
+        if self.beanstream.report_cache:
+            items = self.beanstream.report_cache.write_through_lookups(items)
+        return items
+
     def set_transaction_id(self, transaction_id):
         self.params['rptTransId'] = transaction_id
 
@@ -286,6 +675,9 @@ class CreditCardLookupReport(Report):
 
 class CreditCardLookupReportResponse(ReportResponse):
 
+    __slots__ = ()
+
+    @classmethod
     def _fields(cls):
         return ['transaction_id', 'date', 'source_ip', 'amount', 'type_id',
                 'type_name', 'card_type', 'card_expiry', 'order_id',
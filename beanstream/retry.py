@@ -0,0 +1,150 @@
+'''
+Copyright 2012 Upverter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import httplib
+import logging
+import random
+import sys
+import time
+
+from beanstream import errors
+
+log = logging.getLogger('beanstream.retry')
+
+
+class RetryPolicy(object):
+    """ Retries transactions whose requests fail with a network error or a
+    server error, with exponential backoff and jitter.
+
+    Every attempt sends the same request, with the same order number. Such a
+    failure leaves the outcome of a transaction unknown, so a transaction is
+    only sent again if that is safe:
+
+        - read only and idempotent transactions are simply sent again;
+        - other transactions are first looked up with recover(), e.g. by
+          order number in a transaction report. If the lost attempt went
+          through, its outcome is returned without sending the transaction
+          again;
+        - transactions which cannot be recovered are not retried, and the
+          error is raised.
+
+    A lost attempt may not show up in a report right away. If a resend is
+    then rejected as a duplicate of it, the transaction is looked up again,
+    with backoff, and errors.OutcomeUnknownException is raised if it still
+    cannot be found; the duplicate rejection is never returned.
+
+    Ex.
+        beangw = gateway.Beanstream(retry_policy=retry.RetryPolicy(max_attempts=4))
+    """
+
+    RETRY_STATUSES = (500, 502, 503, 504)
+
+    def __init__(self, max_attempts=3, backoff=0.5, max_backoff=10):
+        """ Create a retry policy.
+
+        Arguments:
+            max_attempts: the most times a transaction is sent
+            backoff: seconds to wait before the first retry; doubled for each
+                retry after that, up to max_backoff, and jittered
+            max_backoff: the longest wait between attempts, in seconds
+        """
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt):
+        """ Returns the seconds to wait after the given failed attempt. """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+    def is_retryable(self, e):
+        """ True if the exception leaves the outcome of a request unknown.
+        Error statuses are returned by the transport rather than raised, and
+        are checked against RETRY_STATUSES in commit(). """
+        return isinstance(e, (IOError, httplib.HTTPException))
+
+    def commit(self, txn, data):
+        """ Send the encoded transaction until a response is received, and
+        return what Transaction.commit() would. """
+        attempt = 0
+        resent = False
+        while True:
+            attempt += 1
+            try:
+                status, body = txn.send(data)
+            except Exception as e:
+                if not self.is_retryable(e) or attempt >= self.max_attempts:
+                    raise
+                failure = sys.exc_info()
+            else:
+                if status not in self.RETRY_STATUSES or attempt >= self.max_attempts:
+                    resp = txn.handle_response(status, body)
+                    if resent and txn.is_duplicate(resp):
+                        return self._recover_duplicate(txn)
+                    return resp
+                failure = None
+
+            log.warning('attempt %d of %s %s failed', attempt, type(txn).__name__, txn.order_number)
+            time.sleep(self.delay(attempt))
+
+            if txn.read_only or txn.idempotent:
+                continue
+
+            resp = self._recover(txn)
+            if resp is _unknown:
+                if failure:
+                    raise failure[0], failure[1], failure[2]
+                return txn.handle_response(status, body)
+            if resp is not None:
+                log.info('recovered the outcome of %s %s', type(txn).__name__, txn.order_number)
+                return resp
+            resent = True
+
+    def _recover_duplicate(self, txn):
+        # the resend was rejected for reusing the order number, so a lost
+        # attempt went through after all; wait for it to show up.
+        log.warning('%s %s was rejected as a duplicate', type(txn).__name__, txn.order_number)
+        for attempt in xrange(1, self.max_attempts + 1):
+            time.sleep(self.delay(attempt))
+            resp = self._recover(txn)
+            if resp is _unknown:
+                break
+            if resp is not None:
+                log.info('recovered the outcome of %s %s', type(txn).__name__, txn.order_number)
+                return resp
+
+        raise errors.OutcomeUnknownException('%s %s was processed, but its outcome could not be found'
+                % (type(txn).__name__, txn.order_number))
+
+    def _recover(self, txn):
+        # look up the outcome of the lost attempt, retrying lookups that fail.
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return txn.recover()
+            except NotImplementedError:
+                log.warning('%s cannot be recovered, not retrying', type(txn).__name__)
+                return _unknown
+            except Exception as e:
+                if not (self.is_retryable(e) or isinstance(e, errors.ResponseException)):
+                    raise
+                if attempt >= self.max_attempts:
+                    log.warning('could not look up %s %s: %s', type(txn).__name__, txn.order_number, e)
+                    return _unknown
+                time.sleep(self.delay(attempt))
+
+
+_unknown = object()
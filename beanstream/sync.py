@@ -0,0 +1,162 @@
+'''
+Copyright 2012 Upverter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import logging
+import os
+import sqlite3
+import tempfile
+
+from beanstream import errors
+
+log = logging.getLogger('beanstream.sync')
+
+# the largest transaction ID asked for; Beanstream IDs are well below this.
+MAX_TRANSACTION_ID = 2147483647
+
+
+class FileCheckpointStore(object):
+    """ Keeps the checkpoint in a local file, which is replaced atomically
+    each time it is saved. """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                value = f.read().strip()
+        except IOError:
+            return None
+
+        return int(value) if value else None
+
+    def save(self, transaction_id):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.checkpoint')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write('%d\n' % transaction_id)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+
+class SQLiteCheckpointStore(object):
+    """ Keeps named checkpoints in a SQLite database. """
+
+    def __init__(self, path, name='transactions'):
+        self.path = path
+        self.name = name
+
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS checkpoints (name TEXT PRIMARY KEY, transaction_id INTEGER NOT NULL)')
+        finally:
+            conn.close()
+
+    def load(self):
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT transaction_id FROM checkpoints WHERE name = ?', (self.name,)).fetchone()
+        finally:
+            conn.close()
+
+        return row[0] if row else None
+
+    def save(self, transaction_id):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO checkpoints (name, transaction_id) VALUES (?, ?)',
+                        (self.name, transaction_id))
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path)
+
+
+class ReportSync(object):
+    """ Mirrors a merchant's transactions incrementally.
+
+    Each run fetches a transaction report for the IDs above the last one seen,
+    which is kept in a checkpoint store, and hands the new report items to a
+    handler in batches. The checkpoint is saved once the handler has returned
+    for a batch, so after a crash only the batch being handled at the time is
+    handed out again; handlers should therefore be idempotent, e.g. upsert by
+    transaction ID.
+
+    Ex.
+        sync = ReportSync(beangw, FileCheckpointStore('/var/lib/app/beanstream.checkpoint'))
+        sync.run(warehouse.upsert_many)
+    """
+
+    def __init__(self, beanstream, store, batch_size=1000, initial_id=0):
+        """ Create a report sync.
+
+        Arguments:
+            beanstream: gateway object
+            store: checkpoint store; an object with load() and save(transaction_id)
+            batch_size: the number of report items passed to each handler call
+            initial_id: the ID to start after when the store has no checkpoint
+        """
+        self.beanstream = beanstream
+        self.store = store
+        self.batch_size = batch_size
+        self.initial_id = initial_id
+
+    def run(self, handler):
+        """ Fetch transactions newer than the checkpoint, calling
+        handler(items) for each batch of them in transaction ID order.
+        Returns the number of items handled.
+        """
+        last_id = self.store.load()
+        if last_id is None:
+            last_id = self.initial_id
+
+        txn = self.beanstream.get_transaction_report()
+        txn.set_transaction_range(str(last_id + 1), str(MAX_TRANSACTION_ID))
+
+        resp = txn.stream()
+        if resp is False:
+            raise errors.ResponseException('transaction report request failed')
+
+        handled = 0
+        batch = []
+        for item in resp:
+            if int(item.transaction_id) <= last_id:
+                continue
+
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._handle(handler, batch)
+                handled += len(batch)
+                batch = []
+
+        if batch:
+            self._handle(handler, batch)
+            handled += len(batch)
+
+        log.info('synced %d new transactions', handled)
+        return handled
+
+    def _handle(self, handler, batch):
+        handler(batch)
+        self.store.save(max(int(item.transaction_id) for item in batch))
@@ -14,16 +14,11 @@ See the License for the specific language governing permissions and
 limitations under the License.
 '''
 
+from datetime import datetime
 import decimal
-import hashlib
 import logging
-import random
-import string
-import urllib
-import urllib2
-import urlparse
 
-from beanstream import errors
+from beanstream import encoding, errors
 from beanstream.response_codes import response_codes
 
 log = logging.getLogger('beanstream.transaction')
@@ -31,6 +26,11 @@ log = logging.getLogger('beanstream.transaction')
 
 class Transaction(object):
 
+    # whether the transaction only reads data, and whether sending it twice
+    # has the same effect as sending it once; see retry.RetryPolicy.
+    read_only = False
+    idempotent = False
+
     URLS = {
         'process_transaction'   : 'https://www.beanstream.com/scripts/process_transaction.asp',
         'recurring_billing'     : 'https://www.beanstream.com/scripts/recurring_billing.asp',
@@ -56,14 +56,18 @@ class Transaction(object):
 
         self.params = {}
 
-        if self.beanstream.USERNAME_VALIDATION:
-            self.params['username'] = self.beanstream.username
-            self.params['password'] = self.beanstream.password
+        # the parameters shared by every request of this kind; see
+        # Beanstream.configure.
+        self.template = self.beanstream.request_templates['transaction']
 
         self._generate_order_number()
         self.params['trnOrderNumber'] = self.order_number
         self.response_params = []
 
+        # when the transaction was first sent, for looking it up if its
+        # response is lost.
+        self.sent_at = None
+
         # default to transaction processing
         self.url = self.URLS['process_transaction']
 
@@ -73,30 +77,44 @@ class Transaction(object):
     def commit(self):
         self.validate()
 
-        # hashing is applicable only to requests sent to the process
-        # transaction API.
-        data = urllib.urlencode(self.params)
-        if self.beanstream.HASH_VALIDATION and self.url == self.URLS['process_transaction']:
-            if self.beanstream.hash_algorithm == 'MD5':
-                hashobj = hashlib.md5()
-            elif self.beanstream.hash_algorithm == 'SHA1':
-                hashobj = hashlib.sha1()
-            else:
-                log.error('Hash method %s is not MD5 or SHA1', self.beanstream.hash_algorithm)
-                raise errors.ConfigurationException('Hash method must be MD5 or SHA1')
-            hashobj.update(data + self.beanstream.hashcode)
-            hash_value = hashobj.hexdigest()
-            data += '&hashValue=%s' % hash_value
+        data = self.encode()
+
+        if self.beanstream.retry_policy is not None:
+            return self.beanstream.retry_policy.commit(self, data)
+
+        status, body = self.send(data)
+        return self.handle_response(status, body)
 
+    def send(self, data):
+        """ Send the encoded transaction. Returns a (status, body) tuple.
+        """
         log.debug('Sending to %s: %s', self.url, data)
+        if self.sent_at is None:
+            self.sent_at = datetime.now()
 
-        res = urllib2.urlopen(self.url, data)
+        hedging_policy = self.beanstream.hedging_policy
+        if hedging_policy is not None and hedging_policy.applies(self):
+            return hedging_policy.send(self.url, self._send, data)
 
-        if res.code != 200:
-            log.error('response code not OK: %s', res.code)
-            return False
+        return self._send(data)
 
-        body = res.read()
+    def _send(self, data):
+        guard = self.beanstream.endpoint_guards.get(self.url)
+        if guard is None:
+            return self.beanstream.transport.send(self.url, data)
+
+        with guard.request() as request:
+            status, body = self.beanstream.transport.send(self.url, data)
+            if status >= 500:
+                request.failed()
+            return status, body
+
+    def handle_response(self, status, body):
+        """ Returns the parsed response, or False if the request failed.
+        """
+        if status != 200:
+            log.error('response code not OK: %s', status)
+            return False
 
         if body == 'Empty hash value':
             log.error('hash validation required')
@@ -108,13 +126,55 @@ class Transaction(object):
 
         return self.response_class(response, *self.response_params)
 
+    def recover(self):
+        """ Look up the outcome of an earlier attempt at this transaction
+        whose response was lost. Returns its response, or None if it was not
+        processed. Raises NotImplementedError for transactions whose outcome
+        cannot be looked up.
+        """
+        raise NotImplementedError
+
+    def is_duplicate(self, resp):
+        """ True if resp rejects this transaction as a duplicate of an earlier
+        attempt at it, e.g. for reusing its order number.
+        """
+        return False
+
+    def encode(self):
+        """ Returns the URL-encoded request body, including the hash value
+        when hash validation is enabled.
+        """
+        # hashing is applicable only to requests sent to the process
+        # transaction API.
+        hash_algorithm = None
+        if self.beanstream.HASH_VALIDATION and self.url == self.URLS['process_transaction']:
+            hash_algorithm = self.beanstream.hash_algorithm
+            if hash_algorithm not in encoding.HASH_ALGORITHMS:
+                log.error('Hash method %s is not MD5 or SHA1', hash_algorithm)
+
+        template = self.template
+        if template.keys.isdisjoint(self.params):
+            return encoding.encode_request(self.params, hash_algorithm, self.beanstream.hashcode, template.encoded)
+
+        # a template parameter was overridden.
+        params = dict(template.params)
+        params.update(self.params)
+        return encoding.encode_request(params, hash_algorithm, self.beanstream.hashcode)
+
+    def commit_async(self):
+        """ Commit the transaction on the gateway's worker threads without
+        blocking. Returns an AsyncResult whose get() returns what commit()
+        would have returned.
+        """
+        return self.beanstream.submit(self.commit)
+
     def parse_raw_response(self, body):
-        return urlparse.parse_qs(body)
+        return encoding.QueryString(body)
 
     def _generate_order_number(self):
-        """ Generate a random 30-digit alphanumeric string.
+        """ Generate a unique 30-digit alphanumeric string.
         """
-        self.order_number = ''.join((random.choice(string.ascii_lowercase + string.digits) for _ in xrange(30)))
+        self.order_number = self.beanstream.order_number_generator.generate()
 
     def _process_amount(self, amount):
         decimal_amount = decimal.Decimal(amount)
@@ -143,9 +203,27 @@ class Transaction(object):
 
 class Response(object):
 
+    __slots__ = ('resp',)
+
     def __init__(self, resp_dict):
+        """ Wrap a parsed response: an encoding.QueryString, or any dict of
+        lists as urlparse.parse_qs returns. """
         self.resp = resp_dict
 
+    def __getstate__(self):
+        return self.resp
+
+    def __setstate__(self, resp):
+        self.resp = resp
+
+    def _value(self, key, default=None):
+        """ Returns the first value of key in the response, or default. """
+        resp = self.resp
+        if type(resp) is encoding.QueryString:
+            return resp.first(key, default)
+        values = resp.get(key)
+        return values[0] if values else default
+
     def __repr__(self):
         return '%s(%s)' % (self.__class__, self.resp)
 
@@ -154,18 +232,18 @@ class Response(object):
 
     def order_number(self):
         ''' Order number assigned in the transaction request. '''
-        return self.resp.get('trnOrderNumber', [None])[0]
+        return self._value('trnOrderNumber')
 
     def transaction_id(self):
         ''' Beanstream transaction identifier '''
-        return self.resp.get('trnId', [None])[0]
+        return self._value('trnId')
 
     def refs(self):
         return [
-            self.resp.get('ref1', [None])[0],
-            self.resp.get('ref2', [None])[0],
-            self.resp.get('ref3', [None])[0],
-            self.resp.get('ref4', [None])[0],
-            self.resp.get('ref5', [None])[0],
+            self._value('ref1'),
+            self._value('ref2'),
+            self._value('ref3'),
+            self._value('ref4'),
+            self._value('ref5'),
         ]
 
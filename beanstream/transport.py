@@ -0,0 +1,246 @@
+'''
+Copyright 2012 Upverter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import httplib
+import logging
+import select
+import socket
+import threading
+import time
+import urllib2
+import urlparse
+
+log = logging.getLogger('beanstream.transport')
+
+
+class Transport(object):
+    """ Sends requests to the Beanstream API.
+
+    Subclasses implement open(), which send() and close() are built on; the
+    gateway is configured with a single transport which every transaction
+    commits through. Custom transports must subclass Transport.
+    """
+
+    def __init__(self, timeout=None):
+        """ Initialize the transport.
+
+        Arguments:
+            timeout: default timeout in seconds for each request (optional).
+        """
+        self.timeout = timeout
+
+    def open(self, url, data, timeout=None):
+        """ POST data to url. Returns a file-like response with a `code`
+        attribute holding the HTTP status, and read() and close() methods.
+
+        Error statuses are returned like any other, not raised; only a
+        request which got no response at all raises.
+        """
+        raise NotImplementedError
+
+    def send(self, url, data, timeout=None):
+        """ POST data to url. Returns a (status, body) tuple.
+        """
+        res = self.open(url, data, timeout)
+        try:
+            return res.code, res.read()
+        finally:
+            res.close()
+
+    def close(self):
+        """ Release any resources held by the transport. """
+        pass
+
+
+class UrllibTransport(Transport):
+    """ Opens a new connection with urllib2 for every request. """
+
+    def open(self, url, data, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        if timeout is None:
+            timeout = socket._GLOBAL_DEFAULT_TIMEOUT
+
+        try:
+            return urllib2.urlopen(url, data, timeout)
+        except urllib2.HTTPError as e:
+            # an HTTPError is a response too, with a code, read() and close().
+            return e
+
+
+class PooledTransport(Transport):
+    """ Reuses kept-alive connections from a ConnectionPool. """
+
+    def __init__(self, max_size=4, idle_timeout=30, timeout=None):
+        super(PooledTransport, self).__init__(timeout)
+        self.pool = ConnectionPool(max_size, idle_timeout, timeout)
+
+    def open(self, url, data, timeout=None):
+        return self.pool.urlopen(url, data, timeout)
+
+    def close(self):
+        self.pool.close()
+
+
+class ConnectionPool(object):
+    """ Keeps persistent HTTP connections to the Beanstream API hosts so that
+    consecutive requests skip the TCP connect and TLS handshake.
+
+    Connections are pooled per (scheme, host, port); idle connections are
+    reused most-recently-used first and are evicted once they have been idle
+    for longer than idle_timeout seconds, or once the server has closed them.
+    """
+
+    HEADERS = {
+        'Content-Type': 'application/x-www-form-urlencoded',
+        'Connection': 'keep-alive',
+    }
+
+    def __init__(self, max_size=4, idle_timeout=30, timeout=None):
+        """ Initialize the pool.
+
+        Arguments:
+            max_size: the maximum number of idle connections kept per host.
+            idle_timeout: seconds a connection may sit idle before it is
+                discarded rather than reused.
+            timeout: socket timeout in seconds for new connections (optional).
+        """
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    def urlopen(self, url, data, timeout=None):
+        """ POST data to url over a pooled connection. Returns a file-like
+        response with a `code` attribute, like urllib2.urlopen.
+        """
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        if timeout is None:
+            timeout = self.timeout
+
+        # a request which fails is never resent here: the server may have
+        # processed it, and resending a payment could charge it twice.
+        conn = self._checkout(key, timeout)
+        try:
+            res = self._request(conn, path, data)
+        except Exception:
+            conn.close()
+            raise
+
+        return PooledResponse(self, key, conn, res)
+
+    def close(self):
+        """ Close all idle connections. """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for connections in idle.itervalues():
+            for conn, _ in connections:
+                conn.close()
+
+    def _request(self, conn, path, data):
+        conn.request('POST', path, data, self.HEADERS)
+        return conn.getresponse()
+
+    def _connect(self, key, timeout):
+        scheme, host, port = key
+        if scheme == 'https':
+            return httplib.HTTPSConnection(host, port, timeout=timeout)
+        return httplib.HTTPConnection(host, port, timeout=timeout)
+
+    def _checkout(self, key, timeout):
+        now = time.time()
+        stale = []
+        conn = None
+
+        with self._lock:
+            connections = self._idle.get(key, [])
+            while connections:
+                candidate, last_used = connections.pop()
+                if now - last_used < self.idle_timeout and not _dropped(candidate):
+                    conn = candidate
+                    break
+                stale.append(candidate)
+
+        if stale:
+            log.debug('discarding %d stale pooled connections to %s', len(stale), key[1])
+        for candidate in stale:
+            candidate.close()
+
+        if conn is None:
+            return self._connect(key, timeout)
+
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn
+
+    def _checkin(self, key, conn):
+        with self._lock:
+            connections = self._idle.setdefault(key, [])
+            if len(connections) < self.max_size:
+                connections.append((conn, time.time()))
+                return
+
+        conn.close()
+
+
+def _dropped(conn):
+    """ True if the server has closed an idle connection. An idle connection
+    has nothing to read, so a readable socket is either at EOF or holding data
+    it should not have; either way it cannot be reused. """
+    if conn.sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+    except (select.error, socket.error, ValueError):
+        return True
+    return bool(readable)
+
+
+class PooledResponse(object):
+    """ Response wrapper which hands its connection back to the pool once the
+    body has been read in full. """
+
+    def __init__(self, pool, key, conn, res):
+        self.code = res.status
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._res = res
+
+    def read(self, amt=None):
+        data = self._res.read(amt)
+        if amt is None or not data:
+            self.close()
+        return data
+
+    def close(self):
+        if self._conn is None:
+            return
+
+        conn, self._conn = self._conn, None
+        if self._res.isclosed() and not self._res.will_close:
+            self._pool._checkin(self._key, conn)
+        else:
+            self._res.close()
+            conn.close()
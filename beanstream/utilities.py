@@ -14,9 +14,65 @@ See the License for the specific language governing permissions and
 limitations under the License.
 '''
 
-from datetime import date
+import calendar
+from datetime import date, datetime
+
+DATETIME_FORMAT = '%m/%d/%Y %I:%M:%S %p'
+
+# reports and notifications repeat the same few dates many times, so parsed
+# dates are memoized as (date, year, month, day, POSIX time of midnight).
+_DATE_CACHE = {}
+_DATE_CACHE_SIZE = 1024
+_EPOCH = date(1970, 1, 1).toordinal()
+_MERIDIEMS = {'AM': 0, 'PM': 12}
 
 def process_date(datestring):
     """ 11/29/2011 --> date(2011, 11, 29) """
-    month, day, year = datestring.split('/')
-    return date(int(year), int(month), int(day))
+    return _parse_date(datestring)[0]
+
+def process_datetime(datetimestring):
+    """ 11/29/2011 3:04:05 PM --> datetime(2011, 11, 29, 15, 4, 5) """
+    try:
+        (_, year, month, day, _), hour, minute, second = _parse_datetime(datetimestring)
+        return datetime(year, month, day, hour, minute, second)
+    except ValueError:
+        # anything out of the ordinary is left to strptime, which raises the
+        # error if it is invalid.
+        return datetime.strptime(datetimestring, DATETIME_FORMAT)
+
+def process_timestamp(datetimestring):
+    """ 11/29/2011 3:04:05 PM --> 1322579045, the POSIX time in seconds,
+    taking the time to be in UTC. """
+    try:
+        parsed, hour, minute, second = _parse_datetime(datetimestring)
+        return parsed[4] + hour * 3600 + minute * 60 + second
+    except ValueError:
+        return calendar.timegm(datetime.strptime(datetimestring, DATETIME_FORMAT).timetuple())
+
+def _parse_date(datestring):
+    parsed = _DATE_CACHE.get(datestring)
+    if parsed is None:
+        month, day, year = datestring.split('/')
+        day = date(int(year), int(month), int(day))
+        parsed = (day, day.year, day.month, day.day, (day.toordinal() - _EPOCH) * 86400)
+        if len(_DATE_CACHE) >= _DATE_CACHE_SIZE:
+            _DATE_CACHE.clear()
+        _DATE_CACHE[datestring] = parsed
+    return parsed
+
+def _parse_datetime(datetimestring):
+    # raises ValueError for anything but the exact format Beanstream uses.
+    datestring, timestring, meridiem = datetimestring.split(' ')
+    hour, minute, second = timestring.split(':')
+    hour, minute, second = int(hour), int(minute), int(second)
+    if not (1 <= hour <= 12 and 0 <= minute < 60 and 0 <= second < 60
+            and meridiem in _MERIDIEMS and datestring[-5:-4] == '/'):
+        raise ValueError(datetimestring)
+    return _parse_date(datestring), hour % 12 + _MERIDIEMS[meridiem], minute, second
+
+def process_cents(amountstring):
+    """ 50.25 --> 5025 """
+    negative = amountstring.startswith('-')
+    whole, _, fraction = amountstring.lstrip('-').partition('.')
+    cents = int(whole or 0) * 100 + int(fraction[:2].ljust(2, '0'))
+    return -cents if negative else cents
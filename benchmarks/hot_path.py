@@ -0,0 +1,280 @@
+#!/usr/bin/python2
+'''
+Copyright 2012 Upverter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Benchmarks for the request/response hot path.
+
+Each step of a transaction is timed on its own against in-memory data, and
+purchases are timed end to end against a local emulator. For every benchmark
+the ops/sec are reported along with the number of objects and bytes still
+held by the results, and report parsing, both whole-body and streamed, also
+reports the growth in peak RSS.
+
+Usage: python benchmarks/hot_path.py [--rows 10000,100000,1000000] [--filter name]
+'''
+
+from cStringIO import StringIO
+from datetime import datetime
+import gc
+import hashlib
+import optparse
+import os
+import resource
+import sys
+import time
+import urllib
+import urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from beanstream import billing, emulator, gateway, reports, transport, utilities
+
+
+PURCHASE_RESPONSE = ('trnApproved=1&trnId=10000123&messageId=1&messageText=Approved&authCode=TEST'
+        '&responseType=T&trnAmount=50.00&trnDate=11%2F29%2F2011+3%3A04%3A05+PM'
+        '&trnOrderNumber=abcdefghijklmnopqrstuvwxyz0123&trnType=P&paymentMethod=CC'
+        '&ref1=&ref2=&ref3=&ref4=&ref5=&avsProcessed=0&avsId=0&avsResult=0'
+        '&avsAddrMatch=0&avsPostalMatch=0&avsMessage=Address+Verification+not+performed'
+        '&cvdId=1&cardType=VI&errorType=N&errorFields=')
+
+
+class StubTransport(transport.Transport):
+
+    def send(self, url, data, timeout=None):
+        return 200, PURCHASE_RESPONSE
+
+
+def create_gateway(**options):
+    beanstream = gateway.Beanstream(hash_validation=True, **options)
+    beanstream.configure(
+            '300200000',
+            'foo corp',
+            'foo_user',
+            'foo_pass',
+            hashcode='api_hc',
+            hash_algorithm='SHA1',
+            payment_profile_passcode='pp_pass',
+            recurring_billing_passcode='rb_pass')
+    return beanstream
+
+
+CARD = billing.CreditCard('John Doe', '4030000010001234', '09', '2030', '123')
+ADDRESS = billing.Address('John Doe', 'john.doe@example.com', '555-555-5555',
+        '123 Fake Street', '', 'Fake City', 'ON', 'A1A1A1', 'CA')
+
+
+def report_body(rows):
+    """ A TAB report with the given number of rows, as report_download.asp
+    returns it. """
+    fields = reports.TransactionReportResponse._fields()
+    row = dict.fromkeys(fields, '')
+    row.update({
+        'merchant_id': '300200000',
+        'merchant_name': 'Foo Corp',
+        'transaction_datetime': '11/29/2011 3:04:05 PM',
+        'transaction_card_owner': 'John Doe',
+        'transaction_ip': '127.0.0.1',
+        'transaction_type': 'P',
+        'transaction_amount': '50.00',
+        'transaction_original_amount': '50.00',
+        'transaction_returns': '0.00',
+        'transaction_batch_number': '12',
+        'transaction_auth_code': 'TEST',
+        'transaction_card_type': 'VI',
+        'transaction_response': '1',
+        'message_id': '1',
+        'billing_name': 'John Doe',
+        'billing_email': 'john.doe@example.com',
+        'billing_city': 'Fake City',
+        'billing_country': 'CA',
+        'eci': '7',
+        'eft_rejected': '0',
+        'eft_returned': '0',
+        'avs_response': '0',
+        'cvd_response': '1',
+        'transaction_currency': 'CAD',
+    })
+
+    lines = ['\t'.join(fields)]
+    for idx in xrange(rows):
+        row['transaction_id'] = str(10000000 + idx)
+        row['transaction_order_number'] = '%030d' % idx
+        lines.append('\t'.join(row[field] for field in fields))
+    return '\r\n'.join(lines) + '\r\n'
+
+
+def deep_size(obj, seen=None):
+    """ Approximate the bytes held by obj and everything it refers to. """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += deep_size(key, seen) + deep_size(value, seen)
+    elif isinstance(obj, (list, tuple, set)):
+        for item in obj:
+            size += deep_size(item, seen)
+    elif hasattr(obj, '__dict__'):
+        size += deep_size(obj.__dict__, seen)
+    elif hasattr(obj, '__slots__'):
+        for cls in type(obj).__mro__:
+            for slot in getattr(cls, '__slots__', ()):
+                if hasattr(obj, slot):
+                    size += deep_size(getattr(obj, slot), seen)
+    return size
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def bench(name, func, min_time=0.5, keep=100):
+    """ Time func() repeatedly for at least min_time seconds and print ops/sec,
+    plus the objects and bytes held by each result. """
+    func()
+
+    number = 1
+    while True:
+        start = time.time()
+        for _ in xrange(number):
+            func()
+        elapsed = time.time() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed == 0 else max(2, int(min_time / elapsed) + 1)
+
+    gc.collect()
+    gc.disable()
+    try:
+        objects = len(gc.get_objects())
+        results = [func() for _ in xrange(keep)]
+        objects = (len(gc.get_objects()) - objects) / float(keep)
+        size = deep_size(results) / float(keep)
+    finally:
+        gc.enable()
+
+    print '%-40s %14.1f ops/sec %10.2f us/op %8.1f objs/op %10.0f bytes/op' % (
+            name, number / elapsed, elapsed / number * 1e6, objects, size)
+
+
+def bench_report(rows, stream=False):
+    """ Time Report.parse_raw_response, or Report.parse_lines over a chunked
+    body when stream is set, plus TransactionReportResponse over a TAB
+    report with the given number of rows. """
+    beanstream = create_gateway()
+    body = report_body(rows)
+
+    gc.collect()
+    rss = peak_rss_kb()
+    start = time.time()
+    txn = beanstream.get_transaction_report()
+    if stream:
+        res = StringIO(body)
+        parsed = txn.parse_lines(reports._read_lines(res, 65536))
+    else:
+        parsed = txn.parse_raw_response(body)
+    parse_elapsed = time.time() - start
+    response = txn.response_class(parsed)
+    consumed = sum(1 for _ in response)
+    elapsed = time.time() - start
+    rss = peak_rss_kb() - rss
+
+    assert consumed == rows
+    print '%-40s %14.1f rows/sec %8.2f s (parse %.2f s) %10d KB peak RSS growth' % (
+            'report %srows=%d' % ('stream ' if stream else '', rows), rows / elapsed,
+            elapsed, parse_elapsed, rss)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--rows', default='10000,100000,1000000',
+            help='comma separated TAB report sizes to parse')
+    parser.add_option('--filter', default='',
+            help='only run benchmarks whose name contains this string')
+    options, _ = parser.parse_args()
+
+    beanstream = create_gateway(transport=StubTransport())
+    purchase = beanstream.purchase(50, CARD, ADDRESS)
+    response = purchase.response_class(purchase.parse_raw_response(PURCHASE_RESPONSE))
+    row = iter(reports.TransactionReportResponse(reports.TransactionReport(beanstream).parse_lines(
+            report_body(1).splitlines(True)))).next()
+
+    benchmarks = [
+        ('order number', lambda: purchase._generate_order_number()),
+        ('process amount', lambda: purchase._process_amount(50)),
+        ('CreditCard.params', CARD.params),
+        ('Address.params', lambda: ADDRESS.params('ord')),
+        ('build purchase', lambda: beanstream.purchase(50, CARD, ADDRESS)),
+        ('urlencode + hash (before)', lambda: _urlencode(dict(purchase.template.params, **purchase.params))),
+        ('encode + hash', purchase.encode),
+        ('parse_qs response (before)', lambda: urlparse.parse_qs(PURCHASE_RESPONSE)),
+        ('parse response', lambda: purchase.parse_raw_response(PURCHASE_RESPONSE)),
+        ('strptime datetime (before)', lambda: datetime.strptime('11/29/2011 3:04:05 PM', utilities.DATETIME_FORMAT)),
+        ('process_datetime', lambda: utilities.process_datetime('11/29/2011 3:04:05 PM')),
+        ('PurchaseResponse accessors', lambda: _access(purchase.response_class(purchase.parse_raw_response(PURCHASE_RESPONSE)))),
+        ('PurchaseResponse status accessors', lambda: (response.approved(), response.cvd_status(),
+                response.get_cardholder_message(), response.get_merchant_message())),
+        ('PurchaseResponse.outcome', response.outcome),
+        ('TransactionReportRow.outcome', row.outcome),
+        ('commit (stub transport)', lambda: beanstream.purchase(50, CARD, ADDRESS).commit()),
+    ]
+
+    for name, func in benchmarks:
+        if options.filter in name:
+            bench(name, func)
+
+    if options.filter in 'commit (emulator)':
+        stand_in = emulator.Emulator()
+        stand_in.start()
+        try:
+            emulated = create_gateway(transport=stand_in.transport())
+            stand_in.hashcode = 'api_hc'
+            bench('commit (emulator)', lambda: emulated.purchase(50, CARD, ADDRESS).commit(), keep=10)
+            emulated.close()
+        finally:
+            stand_in.stop()
+
+    # peak RSS only grows, so the streaming runs go first.
+    if options.filter in 'report stream rows':
+        for rows in options.rows.split(','):
+            bench_report(int(rows), stream=True)
+
+    if options.filter in 'report rows':
+        for rows in options.rows.split(','):
+            bench_report(int(rows))
+
+
+def _urlencode(params):
+    # how requests were encoded before encoding.encode_request.
+    data = urllib.urlencode(params)
+    hashobj = hashlib.sha1()
+    hashobj.update(data + 'api_hc')
+    data += '&hashValue=%s' % hashobj.hexdigest()
+    return data
+
+
+def _access(resp):
+    return (resp.approved(), resp.transaction_id(), resp.order_number(),
+            resp.auth_code(), resp.cvd_status(), resp.get_cardholder_message(),
+            resp.get_merchant_message(), resp.transaction_amount(),
+            resp.transaction_datetime())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+'''
+Copyright 2012 Upverter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import unittest
+
+from beanstream import decoding, encoding, process_transaction, reports
+from beanstream.response_codes import avs_response_codes, response_codes
+
+
+class DecodingTests(unittest.TestCase):
+
+    def test_tables(self):
+        for message_id, code in response_codes.iteritems():
+            message = decoding.message(message_id)
+            assert message is decoding.MESSAGES[int(message_id)] is decoding.message(int(message_id))
+            assert message.cardholder_message == code['cardholder_message']
+            assert message.merchant_message == code['merchant_message']
+            assert message.approved == code['approved']
+
+        for code, avs in avs_response_codes.iteritems():
+            assert decoding.avs_result(code).message == avs['message']
+            assert decoding.avs_result(code).matched == (avs['result'] == '1')
+
+        assert decoding.cvd_status('1') == decoding.cvd_status(1) == 'CVD Match'
+        for unknown in (None, '', '-1', '0', '9999', -1, 9999):
+            assert decoding.message(unknown) is None
+            assert decoding.cvd_status(unknown) is None
+        assert decoding.avs_result('Q') is None
+
+    def test_response_outcome(self):
+        resp = process_transaction.PurchaseResponse(encoding.QueryString(
+                'trnApproved=0&messageId=7&avsId=N&cvdId=2'))
+        outcome = resp.outcome()
+        assert not outcome.approved
+        assert outcome.message.merchant_message == resp.get_merchant_message() == 'Transaction Declined'
+        assert not outcome.avs.matched
+        assert outcome.cvd == resp.cvd_status() == 'CVD Mismatch'
+        assert resp.outcome() is outcome
+
+        resp = process_transaction.PurchaseResponse(encoding.QueryString('trnApproved=1'))
+        assert resp.outcome() == (True, None, None, None)
+        assert resp.cvd_status() is None
+        assert resp.get_cardholder_message() is None
+
+    def test_report_row_outcome(self):
+        fields = reports.TransactionReportResponse._fields()
+        values = [None] * len(fields)
+        values[fields.index('transaction_type')] = 'P'
+        values[fields.index('transaction_response')] = '1'
+        values[fields.index('message_id')] = '1'
+        values[fields.index('avs_response')] = 'Y'
+        values[fields.index('cvd_response')] = '1'
+        row = reports.TransactionReportRow._from_values(values)
+
+        outcome = row.outcome()
+        assert outcome.approved
+        assert outcome.message.cardholder_message == 'Approved'
+        assert outcome.avs.matched
+        assert outcome.cvd == 'CVD Match'
@@ -0,0 +1,647 @@
+'''
+Copyright 2012 Upverter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+from cStringIO import StringIO
+from datetime import date, timedelta
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from beanstream import billing, bulk, emulator, errors, gateway, hedging, report_cache, retry, sync, transport
+
+
+class LossyTransport(transport.Transport):
+    """ Times out on the given number of requests to an endpoint, either
+    before sending them or after they were processed. """
+
+    def __init__(self, transport, endpoint, failures, processed=True):
+        self.transport = transport
+        self.endpoint = endpoint
+        self.failures = failures
+        self.processed = processed
+
+    def open(self, url, data, timeout=None):
+        if self.failures and url.endswith(self.endpoint):
+            self.failures -= 1
+            if self.processed:
+                self.transport.send(url, data, timeout)
+            raise socket.timeout('timed out')
+        return self.transport.open(url, data, timeout)
+
+
+class StallingTransport(transport.Transport):
+    """ Stalls the next request once stall() is called. """
+
+    def __init__(self, transport, delay):
+        self.transport = transport
+        self.delay = delay
+        self.stalled = threading.Event()
+        self.stalled.set()
+        self.done = threading.Event()
+
+    def stall(self):
+        self.stalled.clear()
+        self.done.clear()
+
+    def open(self, url, data, timeout=None):
+        if not self.stalled.is_set():
+            self.stalled.set()
+            time.sleep(self.delay)
+            try:
+                return self.transport.open(url, data, timeout)
+            finally:
+                self.done.set()
+        return self.transport.open(url, data, timeout)
+
+
+class InFlightTransport(transport.Transport):
+    """ Keeps track of the most requests it has had in flight at once. """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def open(self, url, data, timeout=None):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return self.transport.open(url, data, timeout)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+class CountingImporter(bulk.PaymentProfileImporter):
+    """ Counts the rows it has finished importing. """
+
+    def __init__(self, *args, **kwargs):
+        super(CountingImporter, self).__init__(*args, **kwargs)
+        self.finished = 0
+        self.lock = threading.Lock()
+
+    def _import(self, job):
+        try:
+            return super(CountingImporter, self)._import(job)
+        finally:
+            with self.lock:
+                self.finished += 1
+
+
+class EmulatorTests(unittest.TestCase):
+    """ Runs the library against a local Beanstream emulator, so these tests
+    need neither network access nor a beanstream.cfg. """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.emulator = emulator.Emulator()
+        cls.emulator.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.emulator.stop()
+
+    def setUp(self):
+        self.beanstream = self.create_gateway()
+
+        today = date.today()
+        self.card = billing.CreditCard(
+            'John Doe',
+            '4030000010001234',
+            str(today.month), str(today.year + 3),
+            '123')
+        self.declined_card = billing.CreditCard(
+            'John Doe',
+            '4003050500040005',
+            str(today.month), str(today.year + 3),
+            '123')
+
+        self.billing_address = billing.Address(
+            'John Doe',
+            'john.doe@example.com',
+            '555-555-5555',
+            '123 Fake Street',
+            '',
+            'Fake City',
+            'ON',
+            'A1A1A1',
+            'CA')
+
+    def create_gateway(self, **options):
+        options.setdefault('transport', self.emulator.transport())
+        beanstream = gateway.Beanstream(hash_validation=True, **options)
+        beanstream.configure(
+                '300200000',
+                'foo corp',
+                'foo_user',
+                'foo_pass',
+                hashcode='api_hc',
+                hash_algorithm='SHA1',
+                payment_profile_passcode='pp_pass',
+                recurring_billing_passcode='rb_pass')
+        self.addCleanup(beanstream.close)
+        return beanstream
+
+    def test_purchase(self):
+        txn = self.beanstream.purchase(50, self.card, self.billing_address)
+        resp = txn.commit()
+        assert resp.approved()
+        assert resp.cvd_status() == 'CVD Match'
+        assert resp.order_number() == txn.order_number
+        assert resp.transaction_amount() == '50.00'
+        assert resp.transaction_datetime().date() == date.today()
+
+    def test_declined_purchase(self):
+        resp = self.beanstream.purchase(50, self.declined_card, self.billing_address).commit()
+        assert not resp.approved()
+        assert resp.get_cardholder_message() == 'DECLINE'
+
+    def test_void_purchase(self):
+        resp = self.beanstream.purchase(50, self.card, self.billing_address).commit()
+        resp = self.beanstream.void_purchase(resp.transaction_id(), 50).commit()
+        assert resp.approved()
+
+    def test_payment_profiles(self):
+        resp = self.beanstream.create_payment_profile(self.card, self.billing_address).commit()
+        assert resp.approved()
+        customer_code = resp.customer_code()
+
+        resp = self.beanstream.get_payment_profile(customer_code).commit()
+        assert resp.approved()
+        assert resp.card_number().endswith('1234')
+        assert resp.billing_address().email == 'john.doe@example.com'
+
+        resp = self.beanstream.purchase_with_payment_profile(50, customer_code).commit()
+        assert resp.approved()
+
+        txn = self.beanstream.modify_payment_profile(customer_code)
+        txn.set_status('disabled')
+        assert txn.commit().approved()
+
+        resp = self.beanstream.purchase_with_payment_profile(50, customer_code).commit()
+        assert not resp.approved()
+
+    def test_payment_profile_cache(self):
+        slow = emulator.Emulator(latency=0.2)
+        slow.start()
+        try:
+            beanstream = self.create_gateway(transport=slow.transport(), payment_profile_cache_size=10)
+            customer_code = beanstream.create_payment_profile(self.card, self.billing_address).commit().customer_code()
+
+            results = [beanstream.get_payment_profile(customer_code).commit_async() for _ in range(5)]
+            assert all(result.get().approved() for result in results)
+            assert beanstream.get_payment_profile(customer_code).commit().status() == 'active'
+            assert slow.requests['payment_profile.asp'] == 2
+
+            txn = beanstream.modify_payment_profile(customer_code)
+            txn.set_status('disabled')
+            txn.commit()
+            assert beanstream.get_payment_profile(customer_code).commit().status() == 'disabled'
+            assert slow.requests['payment_profile.asp'] == 4
+            beanstream.close()
+        finally:
+            slow.stop()
+
+    def test_bulk_payment_profiles(self):
+        rows = list(bulk.read_csv(StringIO(
+            'card_owner,card_number,card_exp_month,card_exp_year,card_cvd,name,email\r\n'
+            'John Doe,4030000010001234,12,%(year)d,123,John Doe,john.doe@example.com\r\n'
+            ',4030000010001234,12,%(year)d,123,,\r\n'
+            'Jane Doe,4030000010001234,12,%(year)d,,,\r\n' % {'year': date.today().year + 3})))
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'import.journal')
+            importer = bulk.PaymentProfileImporter(self.beanstream, path, max_concurrency=2)
+            counts = importer.run(rows)
+            assert counts == {'created': 2, 'failed': 1}
+
+            entries = importer.journal.load()
+            assert entries[1]['state'] == 'failed'
+            customer_code = entries[2]['customer_code']
+            assert self.beanstream.get_payment_profile(customer_code).commit().card_owner() == 'Jane Doe'
+
+            # a crash after creating the last profile but before journaling it.
+            with open(path, 'ab') as f:
+                f.write(json.dumps({'key': 2, 'state': 'pending', 'customer_code': customer_code}) + '\n')
+
+            # while lookups fail, the pending row is neither created nor failed.
+            failing = emulator.Emulator(error_rate=1)
+            failing.start()
+            try:
+                beanstream = self.create_gateway(transport=failing.transport())
+                counts = bulk.PaymentProfileImporter(beanstream, path).run(rows)
+                assert counts == {'pending': 1, 'skipped': 2}
+                assert failing.requests['payment_profile.asp'] == 1
+                beanstream.close()
+            finally:
+                failing.stop()
+
+            created = self.emulator.requests['payment_profile.asp']
+            counts = importer.run(rows)
+            assert counts == {'created': 1, 'skipped': 2}
+            assert self.emulator.requests['payment_profile.asp'] == created + 1
+            assert importer.journal.load()[2]['customer_code'] == customer_code
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_bulk_payment_profiles_read_lazily(self):
+        tmpdir = tempfile.mkdtemp()
+        importer = CountingImporter(self.beanstream, os.path.join(tmpdir, 'import.journal'), max_concurrency=2)
+        read_ahead = []
+
+        def rows():
+            for idx in range(20):
+                read_ahead.append(idx - importer.finished)
+                yield {'card_owner': 'John Doe', 'card_number': '4030000010001234',
+                        'card_exp_month': '12', 'card_exp_year': str(date.today().year + 3)}
+
+        try:
+            assert importer.run(rows()) == {'created': 20}
+            # the input is read as rows are imported, not all at once.
+            assert max(read_ahead) <= 2
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_recurring_billing(self):
+        txn = self.beanstream.create_recurring_billing_account(50, self.card, 'w', 2, self.billing_address)
+        resp = txn.commit()
+        assert resp.approved()
+        assert resp.account_id() is not None
+
+        txn = self.beanstream.modify_recurring_billing_account(resp.account_id())
+        txn.set_billing_state('closed')
+        assert txn.commit().approved()
+
+    def test_bulk_recurring_billing(self):
+        account_ids = [self.beanstream.create_recurring_billing_account(50, self.card, 'm', 1).commit().account_id()
+                for _ in range(5)]
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            updater = bulk.RecurringBillingUpdater(self.beanstream, os.path.join(tmpdir, 'journal'), rate=100)
+            changes = [(account_id, {'amount': 60}) for account_id in account_ids[:3]]
+            changes.append(('no such account', {'amount': 60}))
+            changes.append((account_ids[3], {'billing_state': 'deleted'}))
+            changes.append((account_ids[4], {'amount': 'abc'}))
+
+            results = updater.run(changes)
+            assert all(results[account_id].approved() for account_id in account_ids[:3])
+            assert not results['no such account'].approved()
+            assert isinstance(results[account_ids[3]], Exception)
+            assert isinstance(results[account_ids[4]], Exception)
+            assert updater.journal.load()[account_ids[4]]['state'] == 'failed'
+            assert self.emulator.accounts[account_ids[4]]['amount'] == '50.00'
+            assert self.emulator.accounts[account_ids[0]]['amount'] == '60.00'
+
+            assert updater.run(changes) == {}
+
+            # the changes are read as accounts are modified, not all at once.
+            path = os.path.join(tmpdir, 'lazy')
+            updater = bulk.RecurringBillingUpdater(self.beanstream, path, max_concurrency=2)
+            read_ahead = []
+
+            def lazy_changes():
+                for idx in range(20):
+                    # one journal entry is written per modification.
+                    modified = sum(1 for _ in open(path)) if os.path.exists(path) else 0
+                    read_ahead.append(idx - modified)
+                    yield account_ids[idx % 3], {'amount': 70 + idx}
+
+            updater.run(lazy_changes())
+            assert max(read_ahead) <= 2
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_reports(self):
+        ids = []
+        for amount in (10, 20, 30):
+            ids.append(self.beanstream.purchase(amount, self.card, self.billing_address).commit().transaction_id())
+
+        txn = self.beanstream.get_transaction_report()
+        txn.set_date_range(date.today(), date.today())
+        rows = list(txn.commit())
+        assert set(ids) <= set(row['transaction_id'] for row in rows)
+
+        resp = self.beanstream.get_transaction_set_report([ids[0], ids[2]]).commit()
+        assert sorted(row['transaction_id'] for row in resp) == [ids[0], ids[2]]
+        for row in resp:
+            assert row['transaction_type'] == 'purchase'
+            assert row['billing_address'].name == 'John Doe'
+            assert row.transaction_amount in ('10.00', '30.00')
+            assert row.shipping_address is None
+
+        resp = self.beanstream.get_credit_card_lookup_report(txn_id=ids[1]).commit()
+        assert [row['amount'] for row in resp.items()] == ['20.00']
+
+    def test_clustered_transaction_set_report(self):
+        ids = []
+        for amount in (10, 20, 30, 40):
+            ids.append(self.beanstream.purchase(amount, self.card, self.billing_address).commit().transaction_id())
+
+        txn = self.beanstream.get_transaction_set_report([ids[0], ids[1], ids[3]], max_gap=1)
+        assert len(txn.ranges) == 2
+        assert [row.transaction_id for row in txn.commit()] == [ids[0], ids[1], ids[3]]
+
+    def test_stream_report(self):
+        for amount in (10, 20, 30):
+            self.beanstream.purchase(amount, self.card, self.billing_address).commit()
+
+        txn = self.beanstream.get_transaction_report()
+        txn.set_date_range(date.today(), date.today())
+        expected = [row['transaction_id'] for row in txn.commit()]
+
+        resp = txn.stream(chunk_size=7)
+        assert [row['transaction_id'] for row in resp] == expected
+        assert len(expected) >= 3
+
+    def test_sharded_report(self):
+        ids = []
+        for amount in (10, 20, 30, 40, 50):
+            ids.append(self.beanstream.purchase(amount, self.card, self.billing_address).commit().transaction_id())
+
+        txn = self.beanstream.get_transaction_report()
+        txn.set_transaction_range(ids[0], ids[-1])
+        resp = txn.stream_sharded(shard_size=2, max_workers=2)
+        assert [row.transaction_id for row in resp] == ids
+
+        txn = self.beanstream.get_transaction_report()
+        txn.set_date_range(date.today() - timedelta(days=3), date.today())
+        resp = txn.stream_sharded(shard_days=2)
+        assert set(ids) <= set(row.transaction_id for row in resp)
+
+        self.assertRaises(errors.ValidationException, txn.stream_sharded, shard_days=0)
+        self.assertRaises(errors.ValidationException, txn.stream_sharded, shard_size=0)
+
+    def test_report_sync(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for store in (sync.FileCheckpointStore(os.path.join(tmpdir, 'checkpoint')),
+                    sync.SQLiteCheckpointStore(os.path.join(tmpdir, 'checkpoint.db'))):
+                self.check_report_sync(store)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def check_report_sync(self, store):
+        seen = []
+        def handler(items):
+            seen.extend(item.transaction_id for item in items)
+
+        report_sync = sync.ReportSync(self.beanstream, store, batch_size=2)
+        report_sync.run(handler)
+        assert store.load() == int(seen[-1])
+
+        ids = [self.beanstream.purchase(amount, self.card, self.billing_address).commit().transaction_id()
+                for amount in (10, 20, 30)]
+
+        def crash(items):
+            handler(items)
+            raise IOError('crashed')
+
+        seen = []
+        self.assertRaises(IOError, report_sync.run, crash)
+        assert seen == ids[:2]
+
+        # the batch being handled when the crash happened is handed out again.
+        seen = []
+        assert report_sync.run(handler) == 3
+        assert seen == ids
+        assert report_sync.run(handler) == 0
+
+    def test_report_cache(self):
+        cache = report_cache.ReportCache(':memory:', settled_after=timedelta(0))
+        beanstream = self.create_gateway(report_cache=cache)
+
+        ids = [beanstream.purchase(amount, self.card, self.billing_address).commit().transaction_id()
+                for amount in (10, 20, 30)]
+        rows = list(beanstream.get_transaction_set_report(ids[:2]).commit())
+        lookup = beanstream.get_credit_card_lookup_report(txn_id=ids[0]).commit().items()
+
+        emulator_rows = self.emulator.transactions
+        self.emulator.transactions = []
+        try:
+            # served from the cache without touching the (now empty) emulator.
+            assert list(beanstream.get_transaction_set_report(ids[:2]).commit()) == rows
+            assert beanstream.get_credit_card_lookup_report(txn_id=ids[0]).commit().items() == lookup
+            assert [row.transaction_id for row in cache.find_by_order_number(rows[0].transaction_order_number)] == [ids[0]]
+            assert ids[0] in [row.transaction_id for row in cache.find_by_date(date.today())]
+        finally:
+            self.emulator.transactions = emulator_rows
+
+        # only the transaction missing from the cache is fetched.
+        resp = beanstream.get_transaction_set_report(ids).commit()
+        assert [row.transaction_id for row in resp] == ids
+
+    def test_report_columns(self):
+        ids = []
+        for amount in ('10.25', '20.50'):
+            ids.append(self.beanstream.purchase(amount, self.card, self.billing_address).commit().transaction_id())
+
+        columns = self.beanstream.get_transaction_set_report(ids).commit().to_columns()
+        assert list(columns['transaction_id']) == [int(txn_id) for txn_id in ids]
+        assert list(columns['transaction_amount']) == [1025, 2050]
+        assert columns['transaction_type'].categories == ['purchase']
+        assert list(columns['transaction_card_type'].codes) == [0, 0]
+
+    def test_retry_policy(self):
+        policy = retry.RetryPolicy(max_attempts=3, backoff=0)
+
+        customer_code = self.beanstream.create_payment_profile(self.card, self.billing_address).commit().customer_code()
+        for processed in (True, False):
+            # card purchases are looked up by card number, others in the
+            # whole transaction report.
+            for with_card in (True, False):
+                lossy = LossyTransport(self.emulator.transport(), 'process_transaction.asp', 1, processed)
+                beanstream = self.create_gateway(transport=lossy, retry_policy=policy)
+                if with_card:
+                    txn = beanstream.purchase(50, self.card, self.billing_address)
+                else:
+                    txn = beanstream.purchase_with_payment_profile(50, customer_code)
+                downloads = self.emulator.requests['report_download.asp']
+                resp = txn.commit()
+                assert resp.approved()
+                assert resp.transaction_amount() == '50.00'
+                assert resp.get_cardholder_message() == 'Approved'
+                assert [row['transaction_order_number'] for row in self.emulator.transactions].count(txn.order_number) == 1
+                if with_card:
+                    # just the one transaction's row is fetched.
+                    assert self.emulator.requests['report_download.asp'] == downloads + processed
+                else:
+                    assert self.emulator.requests['report_download.asp'] == downloads + 1
+
+        lossy = LossyTransport(self.emulator.transport(), 'process_transaction.asp', 1)
+        beanstream = self.create_gateway(transport=lossy, retry_policy=policy)
+        txn = beanstream.create_recurring_billing_account(50, self.card, 'm', 1)
+        self.assertRaises(socket.timeout, txn.commit)
+
+        lossy = LossyTransport(self.emulator.transport(), 'payment_profile.asp', 2)
+        beanstream = self.create_gateway(transport=lossy, retry_policy=policy)
+        assert not beanstream.get_payment_profile('no such customer').commit().approved()
+
+    def test_retry_duplicate_order_number(self):
+        policy = retry.RetryPolicy(max_attempts=3, backoff=0)
+
+        # the lost attempt is missing from the first report, so the resend
+        # is rejected for reusing its order number.
+        for misses in (1, 10):
+            lossy = LossyTransport(self.emulator.transport(), 'process_transaction.asp', 1)
+            beanstream = self.create_gateway(transport=lossy, retry_policy=policy)
+            txn = beanstream.purchase(50, self.card, self.billing_address)
+            lookups = []
+            def recover(recover=txn.recover):
+                lookups.append(recover())
+                return None if len(lookups) <= misses else lookups[-1]
+            txn.recover = recover
+
+            if misses == 1:
+                resp = txn.commit()
+                assert resp.approved()
+                assert resp.transaction_id() == lookups[-1].transaction_id()
+                assert len(lookups) == 2
+            else:
+                self.assertRaises(errors.OutcomeUnknownException, txn.commit)
+            charged = [row for row in self.emulator.transactions
+                    if row['transaction_order_number'] == txn.order_number and row['transaction_response'] == '1']
+            assert len(charged) == 1
+            beanstream.close()
+
+    def test_error_status(self):
+        failing = emulator.Emulator(error_rate=1)
+        failing.start()
+        try:
+            # every transport returns error statuses rather than raising them.
+            for keep_alive in (True, False):
+                beanstream = self.create_gateway(transport=failing.transport(keep_alive=keep_alive))
+                assert beanstream.purchase(50, self.card, self.billing_address).commit() is False
+                assert beanstream.get_transaction_report().stream() is False
+                beanstream.close()
+        finally:
+            failing.stop()
+
+    def test_circuit_breaker(self):
+        failing = emulator.Emulator(error_rate=1)
+        failing.start()
+        try:
+            beanstream = self.create_gateway(transport=failing.transport(), circuit_breaker_failures=2)
+            for _ in range(2):
+                assert beanstream.purchase(50, self.card, self.billing_address).commit() is False
+            self.assertRaises(errors.CircuitOpenException, beanstream.purchase(50, self.card, self.billing_address).commit)
+            assert failing.requests['process_transaction.asp'] == 2
+
+            # other endpoints have circuits of their own.
+            failing.error_rate = 0
+            assert beanstream.get_transaction_report().commit() is not False
+        finally:
+            failing.stop()
+
+    def test_concurrency_limits(self):
+        slow = emulator.Emulator(latency=0.2)
+        slow.start()
+        try:
+            beanstream = self.create_gateway(transport=slow.transport(), concurrency_limit=4,
+                    concurrency_limits={'report_download': 1})
+            reports = [beanstream.get_transaction_report().commit_async() for _ in range(3)]
+            purchases = [beanstream.purchase(50, self.card, self.billing_address).commit_async() for _ in range(3)]
+
+            assert all(result.get().approved() for result in purchases)
+            outcomes = []
+            for result in reports:
+                try:
+                    outcomes.append(result.get() is not False)
+                except errors.ConcurrencyLimitException:
+                    outcomes.append(False)
+            assert outcomes.count(True) == 1
+            beanstream.close()
+        finally:
+            slow.stop()
+
+    def test_hedging(self):
+        stalling = StallingTransport(self.emulator.transport(), 0.3)
+        policy = hedging.HedgingPolicy(percentile=90, min_samples=5)
+        beanstream = self.create_gateway(transport=stalling, hedging_policy=policy)
+        customer_code = beanstream.create_payment_profile(self.card, self.billing_address).commit().customer_code()
+        for _ in range(5):
+            assert beanstream.get_payment_profile(customer_code).commit().approved()
+
+        stalling.stall()
+        start = time.time()
+        assert beanstream.get_payment_profile(customer_code).commit().approved()
+        assert time.time() - start < 0.2
+
+        assert not policy.applies(beanstream.purchase(50, self.card, self.billing_address))
+        assert not policy.applies(beanstream.modify_payment_profile(customer_code))
+        assert policy.applies(beanstream.get_credit_card_lookup_report(txn_id='1'))
+
+        # let the stalled attempt finish before its connection is closed.
+        assert stalling.done.wait(5)
+
+    def test_error_injection(self):
+        failing = emulator.Emulator(error_rate=1)
+        failing.start()
+        try:
+            beanstream = self.create_gateway(transport=failing.transport())
+            assert beanstream.purchase(50, self.card, self.billing_address).commit() is False
+        finally:
+            failing.stop()
+
+    def test_commit_async(self):
+        results = [self.beanstream.purchase(50, self.card, self.billing_address).commit_async() for _ in range(5)]
+        assert all(result.get().approved() for result in results)
+
+    def test_commit_many(self):
+        txns = [
+            self.beanstream.purchase(50, self.card, self.billing_address),
+            self.beanstream.purchase_with_payment_profile(50, 'no such customer'),
+            self.beanstream.purchase(50, self.declined_card, self.billing_address),
+        ]
+        txns[1].set_card(self.card) # invalid: both a card and a customer code
+
+        results = self.beanstream.commit_many(txns, max_concurrency=2)
+        assert results[0].approved()
+        assert isinstance(results[1], Exception)
+        assert not results[2].approved()
+
+    def test_commit_many_shares_limit(self):
+        slow = emulator.Emulator(latency=0.05)
+        slow.start()
+        try:
+            in_flight = InFlightTransport(slow.transport())
+            beanstream = self.create_gateway(transport=in_flight, batch_concurrency=2)
+            batches = [beanstream.submit(beanstream.commit_many,
+                    [beanstream.purchase(50, self.card) for _ in range(4)], max_concurrency=2)
+                    for _ in range(2)]
+            assert all(resp.approved() for batch in batches for resp in batch.get())
+            assert in_flight.max_in_flight == 2
+            beanstream.close()
+
+            # transactions which commit batches of their own don't deadlock.
+            ids = [resp.transaction_id() for resp in batches[0].get()]
+            in_flight.max_in_flight = 0
+            beanstream = self.create_gateway(transport=in_flight, batch_concurrency=1)
+            txns = [beanstream.get_transaction_set_report([ids[0], ids[2]], max_gap=1) for _ in range(2)]
+            for resp in beanstream.commit_many(txns):
+                assert sorted(row.transaction_id for row in resp) == [ids[0], ids[2]]
+            assert in_flight.max_in_flight == 1
+            beanstream.close()
+        finally:
+            slow.stop()
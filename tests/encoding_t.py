@@ -0,0 +1,87 @@
+'''
+Copyright 2012 Upverter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+from decimal import Decimal
+import hashlib
+import pickle
+import unittest
+import urllib
+import urlparse
+
+from beanstream import billing, encoding, errors, gateway, process_transaction
+
+
+class EncodingTests(unittest.TestCase):
+
+    params = {
+        'trnAmount': Decimal('50.00'),
+        'trnCardOwner': 'John Doe',
+        'ordEmailAddress': 'john.doe+test@example.com',
+        'ordAddress1': u'123 Fake Street, Apt #4',
+        'trnComments': 'tilde~ slash/ percent% \xe9\x00',
+        'rbBillingIncrement': 2,
+        'empty': '',
+        'key with spaces': 'x',
+    }
+
+    def test_matches_urlencode(self):
+        assert encoding.encode_request(self.params) == urllib.urlencode(self.params)
+        for c in map(chr, xrange(256)):
+            assert encoding.quote_plus(c) == urllib.quote_plus(c)
+
+    def test_hash(self):
+        data = urllib.urlencode(self.params)
+        for algorithm, hashfunc in (('MD5', hashlib.md5), ('SHA1', hashlib.sha1)):
+            expected = data + '&hashValue=' + hashfunc(data + 'api_hc').hexdigest()
+            assert encoding.encode_request(self.params, algorithm, 'api_hc') == expected
+
+        self.assertRaises(errors.ConfigurationException, encoding.encode_request, self.params, 'SHA256', 'api_hc')
+
+    def test_request_templates(self):
+        beanstream = gateway.Beanstream(hash_validation=True)
+        beanstream.configure('300200000', 'foo corp', 'foo_user', 'foo_pass',
+                hashcode='api_hc', hash_algorithm='SHA1')
+        card = billing.CreditCard('John Doe', '4030000010001234', '09', '2030', '123')
+        txn = beanstream.purchase(50, card)
+
+        params = dict(txn.template.params, **txn.params)
+        data = txn.encode()
+        body, hash_value = data.rsplit('&hashValue=', 1)
+        assert hash_value == hashlib.sha1(body + 'api_hc').hexdigest()
+        assert urlparse.parse_qs(body) == urlparse.parse_qs(urllib.urlencode(params))
+        assert body.startswith(txn.template.encoded + '&')
+
+        # parameters set on the transaction win over the template.
+        txn.params['requestType'] = 'FRONTEND'
+        assert urlparse.parse_qs(txn.encode())['requestType'] == ['FRONTEND']
+
+    def test_query_string(self):
+        for body in ('trnApproved=1&trnId=10000123&messageText=Approved+by%20bank&ref1=&cvdId=1',
+                'a=1&a=2;b=x+y&c&=d&e=%41%2', '', '&&;'):
+            qs = encoding.QueryString(body)
+            assert qs == urlparse.parse_qs(body)
+            assert sorted(qs.items()) == sorted(urlparse.parse_qs(body).items())
+
+        qs = encoding.QueryString('trnApproved=1&messageText=Approved+by%20bank&a=1&a=2')
+        assert qs.first('messageText') == 'Approved by bank'
+        assert qs.first('a') == '1'
+        assert qs.first('ref1', 'none') == 'none'
+
+        resp = process_transaction.PurchaseResponse(qs)
+        assert resp.approved()
+        resp = pickle.loads(pickle.dumps(resp, pickle.HIGHEST_PROTOCOL))
+        assert resp.resp == {'trnApproved': ['1'], 'messageText': ['Approved by bank'], 'a': ['1', '2']}
+        assert process_transaction.PurchaseResponse(urlparse.parse_qs('trnApproved=1')).approved()
@@ -0,0 +1,79 @@
+'''
+Copyright 2012 Upverter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import threading
+import time
+import unittest
+
+from beanstream import hedging
+
+
+class HedgingPolicyTests(unittest.TestCase):
+
+    url = 'https://www.beanstream.com/scripts/payment_profile.asp'
+
+    def create_policy(self, latency, **options):
+        policy = hedging.HedgingPolicy(min_samples=5, **options)
+        for _ in range(5):
+            policy.record(self.url, latency)
+        return policy
+
+    def test_unhedged_request_not_slowed(self):
+        policy = self.create_policy(0.07, min_delay=1)
+        calls = []
+        def send(data):
+            calls.append(data)
+            time.sleep(0.07)
+            return data
+
+        elapsed = []
+        for _ in range(5):
+            start = time.time()
+            assert policy.send(self.url, send, 'data') == 'data'
+            elapsed.append(time.time() - start)
+        assert sorted(elapsed)[2] < 0.08
+        assert len(calls) == 5
+
+    def test_hedged_request(self):
+        policy = self.create_policy(0.01)
+        lock = threading.Lock()
+        calls = []
+        def send(data):
+            with lock:
+                calls.append(data)
+                first = len(calls) == 1
+            time.sleep(0.5 if first else 0.01)
+            return len(calls)
+
+        start = time.time()
+        assert policy.send(self.url, send, 'data') == 2
+        assert time.time() - start < 0.2
+
+    def test_errors(self):
+        policy = self.create_policy(0.01)
+        def fail(data):
+            raise IOError('down')
+        self.assertRaises(IOError, policy.send, self.url, fail, 'data')
+
+        # an attempt which fails is covered by the other.
+        calls = []
+        def flaky(data):
+            calls.append(data)
+            if len(calls) == 1:
+                time.sleep(0.05)
+                raise IOError('down')
+            return 'ok'
+        assert policy.send(self.url, flaky, 'data') == 'ok'
@@ -0,0 +1,63 @@
+'''
+Copyright 2012 Upverter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import time
+import unittest
+
+from beanstream import errors, limits
+
+
+class LimitsTests(unittest.TestCase):
+
+    def test_circuit_breaker(self):
+        breaker = limits.CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        breaker.before()
+        breaker.record(False)
+        breaker.before()
+        breaker.record(False)
+        assert breaker.state == 'open'
+        self.assertRaises(errors.CircuitOpenException, breaker.before)
+
+        # a single trial request after the reset timeout.
+        time.sleep(0.05)
+        breaker.before()
+        self.assertRaises(errors.CircuitOpenException, breaker.before)
+        breaker.record(False)
+        assert breaker.state == 'open'
+
+        time.sleep(0.05)
+        breaker.before()
+        breaker.record(True)
+        assert breaker.state == 'closed'
+        breaker.before()
+
+    def test_adaptive_limiter(self):
+        limiter = limits.AdaptiveLimiter(max_limit=4, latency_target=1)
+        for _ in range(4):
+            limiter.acquire()
+        self.assertRaises(errors.ConcurrencyLimitException, limiter.acquire)
+
+        limiter.release(0.1, False)
+        assert limiter.limit == 2
+        limiter.release(2, True)
+        assert limiter.limit == 1
+        for _ in range(2):
+            limiter.release(0.1, True)
+        assert limiter.limit == 2.5
+
+        limiter.acquire()
+        limiter.acquire()
+        self.assertRaises(errors.ConcurrencyLimitException, limiter.acquire)
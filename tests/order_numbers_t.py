@@ -0,0 +1,51 @@
+'''
+Copyright 2012 Upverter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import os
+import unittest
+
+from beanstream import errors, order_numbers
+
+
+class OrderNumberTests(unittest.TestCase):
+
+    def check_order_numbers(self, generator):
+        generated = [generator.generate() for _ in xrange(10000)]
+        assert len(set(generated)) == len(generated)
+        for order_number in generated:
+            assert len(order_number) == 30
+            assert set(order_number) <= set(order_numbers.ALPHABET)
+        return generated
+
+    def test_random(self):
+        generator = order_numbers.RandomOrderNumberGenerator(buffer_size=64)
+        self.check_order_numbers(generator)
+
+        # a forked child does not reuse the parent's buffered bytes.
+        before = generator._chars[generator._offset:]
+        generator._pid = os.getpid() + 1
+        assert not before.startswith(generator.generate())
+
+    def test_sequential(self):
+        generator = order_numbers.SequentialOrderNumberGenerator(node_id=42)
+        generated = self.check_order_numbers(generator)
+        assert generated == sorted(generated)
+        assert generated[0][9:17] == '00000016'
+
+        other = order_numbers.SequentialOrderNumberGenerator(node_id=43)
+        assert generator.generate()[9:] != other.generate()[9:]
+        self.assertRaises(errors.ConfigurationException,
+                order_numbers.SequentialOrderNumberGenerator, -1)
@@ -0,0 +1,50 @@
+'''
+Copyright 2012 Upverter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import unittest
+
+from beanstream import reports
+
+
+class ReportTests(unittest.TestCase):
+
+    def test_plan_ranges(self):
+        assert reports.plan_ranges([5], 10) == [(5, 5)]
+        assert reports.plan_ranges([1, 2, 3, 5000, 5001, 9000], 1000) == [(1, 3), (5000, 5001), (9000, 9000)]
+        assert reports.plan_ranges([1, 11, 21], 10) == [(1, 21)]
+        assert reports.plan_ranges([1, 11, 21], 9) == [(1, 1), (11, 11), (21, 21)]
+
+    def test_row_keys(self):
+        fields = reports.TransactionReportResponse._fields()
+        values = [None] * len(fields)
+        values[fields.index('transaction_type')] = 'P'
+        values[fields.index('transaction_id')] = '10000001'
+        row = reports.TransactionReportRow._from_values(values)
+
+        assert row.transaction_id == row['transaction_id'] == row[fields.index('transaction_id')] == '10000001'
+        assert row.transaction_type == row.get('transaction_type') == 'purchase'
+        assert row['billing_address'] is None
+        for key in ('count', 'index', 'no_such_field'):
+            self.assertRaises(KeyError, lambda: row[key])
+            assert row.get(key, 'default') == 'default'
+
+        assert 'transaction_id' in row
+        assert 'billing_address' not in row
+        assert 'message_id' not in row
+        assert 'count' not in row
+        assert '10000001' not in row
+        assert row.keys() == ['transaction_id', 'transaction_type']
+        assert dict(row) == {'transaction_id': '10000001', 'transaction_type': 'purchase'}
@@ -0,0 +1,162 @@
+'''
+Copyright 2012 Upverter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import httplib
+import socket
+import threading
+import time
+import unittest
+
+from beanstream import emulator, transport
+
+
+class ClosingServer(object):
+    """ Answers a single request on each connection, then closes it even
+    though the client asked for it to be kept alive. """
+
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.url = 'http://127.0.0.1:%d/' % self.sock.getsockname()[1]
+        self.connections = 0
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except socket.error:
+                return
+            self.connections += 1
+            request = ''
+            while '\r\n\r\n' not in request:
+                request += conn.recv(4096)
+            conn.sendall('HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+            conn.close()
+
+    def stop(self):
+        self.sock.close()
+
+
+class ConnectionPoolTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.emulator = emulator.Emulator()
+        cls.emulator.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.emulator.stop()
+
+    def create_pool(self, **options):
+        pool = transport.ConnectionPool(**options)
+        self.addCleanup(pool.close)
+        return pool
+
+    def idle(self, pool):
+        return [conn for connections in pool._idle.values() for conn, _ in connections]
+
+    def test_reuse(self):
+        pool = self.create_pool()
+        res = pool.urlopen(self.emulator.url + '/missing', 'a=1')
+        assert res.code == 404
+        assert res.read() == 'Not Found'
+        [conn] = self.idle(pool)
+
+        assert pool.urlopen(self.emulator.url + '/missing', 'a=1').read() == 'Not Found'
+        assert self.idle(pool) == [conn]
+
+    def test_idle_eviction(self):
+        pool = self.create_pool(idle_timeout=0.05)
+        pool.urlopen(self.emulator.url + '/missing', 'a=1').read()
+        [conn] = self.idle(pool)
+
+        time.sleep(0.1)
+        pool.urlopen(self.emulator.url + '/missing', 'a=1').read()
+        assert conn.sock is None
+        assert self.idle(pool) != [conn]
+        assert len(self.idle(pool)) == 1
+
+    def test_server_closed_connection(self):
+        server = ClosingServer()
+        self.addCleanup(server.stop)
+        pool = self.create_pool()
+        for _ in range(3):
+            res = pool.urlopen(server.url, 'a=1')
+            assert res.read() == 'ok'
+            # let the server's FIN arrive before the connection is reused.
+            time.sleep(0.05)
+        assert server.connections == 3
+
+    def test_no_resend(self):
+        # a kept-alive connection the server closed after the check is not
+        # silently retried, since the request may have been processed.
+        server = ClosingServer()
+        self.addCleanup(server.stop)
+        pool = self.create_pool()
+        pool.urlopen(server.url, 'a=1').read()
+        time.sleep(0.05)
+        transport._dropped, dropped = (lambda conn: False), transport._dropped
+        try:
+            self.assertRaises((httplib.BadStatusLine, socket.error), pool.urlopen, server.url, 'a=1')
+        finally:
+            transport._dropped = dropped
+        assert server.connections == 1
+
+    def test_max_size(self):
+        pool = self.create_pool(max_size=2)
+        responses = [pool.urlopen(self.emulator.url + '/missing', 'a=1') for _ in range(3)]
+        conns = [res._conn for res in responses]
+        for res in responses:
+            res.read()
+        assert sorted(self.idle(pool)) == sorted(conns[:2])
+        assert conns[2].sock is None
+
+    def test_concurrent_checkout(self):
+        pool = self.create_pool(max_size=4)
+        in_use = set()
+        lock = threading.Lock()
+        errors = []
+
+        def run():
+            try:
+                for _ in range(20):
+                    res = pool.urlopen(self.emulator.url + '/missing', 'a=1')
+                    with lock:
+                        # a connection is never handed to two requests at once.
+                        assert res._conn not in in_use
+                        in_use.add(res._conn)
+                    body = res._res.read()
+                    with lock:
+                        in_use.discard(res._conn)
+                    # hands the connection back to the pool.
+                    res.close()
+                    assert body == 'Not Found'
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        assert 1 <= len(self.idle(pool)) <= 4
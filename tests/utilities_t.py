@@ -0,0 +1,55 @@
+'''
+Copyright 2012 Upverter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import calendar
+from datetime import date, datetime
+import unittest
+
+from beanstream import encoding, notifications, process_transaction, utilities
+
+
+class UtilitiesTests(unittest.TestCase):
+
+    def test_process_datetime(self):
+        for value in ('11/29/2011 3:04:05 PM', '11/29/2011 3:04:05 AM', '01/01/2012 12:00:00 AM',
+                '1/1/2012 12:59:59 PM', '02/29/2012 11:59:59 PM', '12/31/1969 11:00:00 PM',
+                '11/29/2011 03:04:05 pm'):
+            expected = datetime.strptime(value, '%m/%d/%Y %I:%M:%S %p')
+            assert utilities.process_datetime(value) == expected
+            assert utilities.process_timestamp(value) == calendar.timegm(expected.timetuple())
+
+        for value in ('11/29/2011 13:04:05 PM', '11/29/2011 0:04:05 AM', '11/29/2011 3:60:05 PM',
+                '11/29/11 3:04:05 PM', '02/30/2012 3:04:05 PM', '11/29/2011 3:04:05', '11/29/2011', ''):
+            self.assertRaises(ValueError, utilities.process_datetime, value)
+            self.assertRaises(ValueError, utilities.process_timestamp, value)
+
+    def test_process_date(self):
+        assert utilities.process_date('11/29/2011') == date(2011, 11, 29)
+        assert utilities.process_date('1/2/2012') == date(2012, 1, 2)
+        assert utilities.process_date('11/29/2011') is utilities.process_date('11/29/2011')
+        self.assertRaises(ValueError, utilities.process_date, '02/30/2012')
+        self.assertRaises(ValueError, utilities.process_date, '2012-02-01')
+
+    def test_responses(self):
+        resp = process_transaction.PurchaseResponse(encoding.QueryString('trnDate=11%2F29%2F2011+3%3A04%3A05+PM'))
+        assert resp.transaction_datetime() == datetime(2011, 11, 29, 15, 4, 5)
+        assert process_transaction.PurchaseResponse(encoding.QueryString('')).transaction_datetime() is None
+
+        notification = notifications.RecurringBillingNotification({'billingDate': '11/29/2011',
+            'periodFrom': '11/01/2011', 'periodTo': '11/30/2011'})
+        assert notification.billing_date() == date(2011, 11, 29)
+        assert notification.period_from() == date(2011, 11, 1)
+        assert notification.period_to() == date(2011, 11, 30)